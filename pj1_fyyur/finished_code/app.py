@@ -2,10 +2,9 @@
 # Imports
 #----------------------------------------------------------------------------#
 
-import json
 import dateutil.parser
-import babel
 import collections
+import collections.abc
 from datetime import datetime
 from flask import (
     Flask, 
@@ -15,35 +14,119 @@ from flask import (
     flash, 
     redirect, 
     url_for,
-    abort
+    abort,
+    jsonify,
+    current_app
 )
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+import click
+import importlib
 import logging
 from logging import Formatter, FileHandler
-from flask_wtf import Form, FlaskForm
-from forms import *
 from models import db, Venue, Artist, Shows
+from events import show_events, publish_shows, stream
+from templating import init_templates, warm_templates
 
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
 collections.Callable = collections.abc.Callable
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db.init_app(app)
-migrate = Migrate(app, db)
+moment = Moment()
+migrate = Migrate()
+
+# Controllers register themselves with @route / @errorhandler and are bound
+# to an application inside create_app(), so endpoint names ('venues',
+# 'show_artist', ...) stay exactly what the templates expect.
+routes = []
+error_handlers = []
+
+def route(rule, **options):
+  def decorator(view):
+    routes.append((rule, view, options))
+    return view
+  return decorator
+
+def errorhandler(code):
+  def decorator(handler):
+    error_handlers.append((code, handler))
+    return handler
+  return decorator
+
+# Feature modules (rollups, recommendations, geo, ...) are imported by the
+# views and commands that use them, so a cold worker only loads what its
+# requests touch; preload() imports them all up front.
+FEATURES = ('babel.dates', 'forms', 'numpy', 'rollups', 'recommendations',
+            'search', 'geo', 'calendars', 'patches', 'metrics')
+COMMANDS = {
+  'rollups': 'rollups:rollups_cli',
+  'recommendations': 'recommendations:recommendations_cli',
+  'geo': 'geo:geo_cli',
+  'templates': 'templating:templates_cli',
+}
+
+class LazyCommand(click.Group):
+  # `flask <name> ...` imports the command group's module only when it runs
+  def __init__(self, name):
+    super().__init__(name, help='See {}.py.'.format(COMMANDS[name].split(':')[0]))
+
+  def group(self):
+    module, attr = COMMANDS[self.name].split(':')
+    return getattr(importlib.import_module(module), attr)
+
+  def list_commands(self, ctx):
+    return self.group().list_commands(ctx)
+
+  def get_command(self, ctx, name):
+    return self.group().get_command(ctx, name)
+
+def create_app(config='config'):
+  app = Flask(__name__)
+  app.config.from_object(config)
+  init_templates(app)
+  db.init_app(app)
+  moment.init_app(app)
+  migrate.init_app(app, db)
+  show_events.init_app(app)
+  # Done: connect to a local postgresql database
+
+  app.jinja_env.filters['datetime'] = format_datetime
+
+  for rule, view, options in routes:
+    app.add_url_rule(rule, view_func=view, **options)
+  for code, handler in error_handlers:
+    app.register_error_handler(code, handler)
+  for name in COMMANDS:
+    app.cli.add_command(LazyCommand(name))
+
+  if not app.debug:
+    file_handler = FileHandler('error.log')
+    file_handler.setFormatter(
+        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+    )
+    app.logger.setLevel(logging.INFO)
+    file_handler.setLevel(logging.INFO)
+    app.logger.addHandler(file_handler)
+    app.logger.info('errors')
 
-# Done: connect to a local postgresql database
+  return app
+
+def preload(app):
+  # Import and compile everything a request may need up front. Prefork
+  # servers call this in the master before forking so the workers share the
+  # loaded modules and templates instead of paying for them on their first
+  # request.
+  for name in FEATURES:
+    importlib.import_module(name)
+  warm_templates(app)
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
 def format_datetime(value, format='medium'):
+  import babel.dates
   date = dateutil.parser.parse(value)
   if format == 'full':
       format="EEEE MMMM, d, y 'at' h:mma"
@@ -51,20 +134,30 @@ def format_datetime(value, format='medium'):
       format="EE MM, dd, y h:mma"
   return babel.dates.format_datetime(date, format)
 
-app.jinja_env.filters['datetime'] = format_datetime
-
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
-@app.route('/')
+@route('/')
 def index():
   return render_template('pages/home.html')
 
+#  Search
+#  ----------------------------------------------------------------
+
+@route('/search', methods=['GET', 'POST'])
+def search_all():
+  # one ranked search over venues, artists and shows, grouped by type
+  from search import search
+  search_term = request.values.get('search_term', '').strip()
+  page = max(request.args.get('page', 1, type=int), 1)
+  results = search(search_term, page) if search_term else None
+  return render_template('pages/search.html', results=results, search_term=search_term)
+
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+@route('/venues')
 def venues():
   # Done?: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
@@ -86,7 +179,7 @@ def venues():
       })
   return render_template('pages/venues.html', areas=locals)
 
-@app.route('/venues/search', methods=['POST'])
+@route('/venues/search', methods=['POST'])
 def search_venues():
   # Done: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for Hop should return "The Musical Hop".
@@ -113,10 +206,29 @@ def search_venues():
   }
   return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
-@app.route('/venues/<int:venue_id>')
+@route('/venues/nearby')
+def venues_nearby():
+  # k nearest venues to ?lat=&lng= (or to ?city=&state=), nearest first
+  from geo import lookup, nearby_venues
+  latitude = request.args.get('lat', type=float)
+  longitude = request.args.get('lng', type=float)
+  if latitude is None or longitude is None:
+    point = lookup(request.args.get('city'), request.args.get('state'))
+    if point is None:
+      abort(400)
+    latitude, longitude = point
+  k = min(max(request.args.get('k', 10, type=int), 1), 100)
+  return jsonify({
+    'latitude': latitude,
+    'longitude': longitude,
+    'venues': nearby_venues(latitude, longitude, k),
+  })
+
+@route('/venues/<int:venue_id>')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # Done: replace with real venue data from the venues table, using venue_id
+  from recommendations import similar_venues
   venue = Venue.query.get_or_404(venue_id)
 
   past_shows = []
@@ -153,20 +265,40 @@ def show_venue(venue_id):
       "upcoming_shows": upcoming_shows,
       "past_shows_count": len(past_shows),
       "upcoming_shows_count": len(upcoming_shows),
+      "similar_venues": similar_venues(venue_id),
   }
 
   return render_template('pages/show_venue.html', venue=data)
 
-@app.route('/venues/<venue_id>', methods=['POST'])
+@route('/venues/<int:venue_id>/stats')
+def venue_dashboard(venue_id):
+  # per-venue booking stats, served from the ShowRollup table
+  from rollups import venue_stats
+  Venue.query.with_entities(Venue.id).filter_by(id=venue_id).first_or_404()
+  return jsonify(venue_stats(venue_id))
+
+@route('/venues/<int:venue_id>/calendar.ics')
+def venue_calendar(venue_id):
+  return calendar_response('venue', venue_id)
+
+@route('/venues/<int:venue_id>', methods=['PATCH'])
+def patch_venue(venue_id):
+  return patch_response('venue', venue_id, ('name',))
+
+@route('/venues/<venue_id>', methods=['POST'])
 def delete_venue(venue_id):
   # Done: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
+  from recommendations import forget
   error = False
   v_id = db.session.query(Venue).filter_by(id=venue_id).one()
   to_delete = v_id
   try:
+    deleted_shows = [show.id for show in to_delete.shows]
+    forget('venue', to_delete.id)
     db.session.delete(to_delete)
     db.session.commit()
+    publish_shows('deleted', deleted_shows)
     flash('Venue sucessfully deleted!')
   except:
     db.session.rollback()
@@ -180,15 +312,18 @@ def delete_venue(venue_id):
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@route('/venues/create', methods=['GET'])
 def create_venue_form():
+  from forms import VenueForm
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/create', methods=['POST'])
+@route('/venues/create', methods=['POST'])
 def create_venue_submission():
   # Done: insert form data as a new Venue record in the db, instead
   # Done: modify data to be the data object returned from db insertion
+  from forms import VenueForm
+  from geo import locate
   form = VenueForm(request.form)
   error = False
 
@@ -196,6 +331,7 @@ def create_venue_submission():
     try:
       new_venue = Venue()
       form.populate_obj(new_venue)
+      locate(new_venue)
       db.session.add(new_venue)
       db.session.commit()
     except:
@@ -219,8 +355,9 @@ def create_venue_submission():
       flash(field + ' - ' + str(message), 'danger')
     return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
+  from forms import VenueForm
   form = VenueForm()
   edit_venue = Venue.query.filter_by(id=venue_id).one()
   form.name.data = edit_venue.name
@@ -238,18 +375,23 @@ def edit_venue(venue_id):
   # Done: populate form with values from venue with ID <venue_id>
   return render_template('forms/edit_venue.html', form=form, venue=edit_venue)
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
   # Done: take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
+  from forms import VenueForm
+  from geo import locate
   form = VenueForm(request.form)
   error = False
 
   if form.validate():
     try:
       edit_venue = Venue.query.filter_by(id=venue_id).one()
+      show_ids = [show.id for show in edit_venue.shows]
       form.populate_obj(edit_venue)
+      locate(edit_venue)
       db.session.commit()
+      publish_shows('updated', show_ids)
     except:
       db.session.rollback()
       flash('Unable to update Venue!')
@@ -266,7 +408,7 @@ def edit_venue_submission(venue_id):
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@route('/artists')
 def artists():
   # Done: replace with real data returned from querying the database
   locals = []
@@ -293,7 +435,7 @@ def artists():
     })
   return render_template('pages/artists.html', artists=locals)
 
-@app.route('/artists/search', methods=['POST'])
+@route('/artists/search', methods=['POST'])
 def search_artists():
   # Done: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
@@ -320,9 +462,10 @@ def search_artists():
 
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
-@app.route('/artists/<int:artist_id>')
+@route('/artists/<int:artist_id>')
 def show_artist(artist_id):
   # shows the artist page with the given aritst_id
+  from recommendations import similar_artists
   artist = Artist.query.get(artist_id)
 
   past_shows = []
@@ -358,20 +501,40 @@ def show_artist(artist_id):
       "upcoming_shows": upcoming_shows,
       "past_shows_count": len(past_shows),
       "upcoming_shows_count": len(upcoming_shows),
+      "similar_artists": similar_artists(artist_id),
   }
 
   return render_template('pages/show_artist.html', artist=data)
 
-@app.route('/artists/<artist_id>', methods=['POST'])
+@route('/artists/<int:artist_id>/stats')
+def artist_dashboard(artist_id):
+  # per-artist booking stats, served from the ShowRollup table
+  from rollups import artist_stats
+  Artist.query.with_entities(Artist.id).filter_by(id=artist_id).first_or_404()
+  return jsonify(artist_stats(artist_id))
+
+@route('/artists/<int:artist_id>/calendar.ics')
+def artist_calendar(artist_id):
+  return calendar_response('artist', artist_id)
+
+@route('/artists/<int:artist_id>', methods=['PATCH'])
+def patch_artist(artist_id):
+  return patch_response('artist', artist_id, ('name', 'image_link'))
+
+@route('/artists/<artist_id>', methods=['POST'])
 def delete_artist(artist_id):
   # Done: Complete this endpoint for taking a artist_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
+  from recommendations import forget
   error = False
   a_id = db.session.query(Artist).filter_by(id=artist_id).one()
   to_delete = a_id
   try:
+    deleted_shows = [show.id for show in to_delete.shows]
+    forget('artist', to_delete.id)
     db.session.delete(to_delete)
     db.session.commit()
+    publish_shows('deleted', deleted_shows)
     flash('Artist sucessfully deleted!')
   except:
     db.session.rollback()
@@ -382,8 +545,9 @@ def delete_artist(artist_id):
   # clicking that button delete it from the db then redirect the user to the homepage
   return redirect(url_for('index'))
 
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
+  from forms import ArtistForm
   form = ArtistForm()
   edit_artist = Artist.query.filter_by(id=artist_id).one()
   form.name.data = edit_artist.name
@@ -400,18 +564,21 @@ def edit_artist(artist_id):
   # Done: populate form with fields from artist with ID <artist_id>
   return render_template('forms/edit_artist.html', form=form, artist=edit_artist)
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
   # Done: take values from the form submitted, and update existing
   # artist record with ID <artist_id> using the new attributes
+  from forms import ArtistForm
   form = ArtistForm(request.form)
   error = False
 
   if form.validate():
     try:
       edit_artist = Artist.query.filter_by(id=artist_id).one()
+      show_ids = [show.id for show in edit_artist.shows]
       form.populate_obj(edit_artist)
       db.session.commit()
+      publish_shows('updated', show_ids)
     except:
       db.session.rollback()
       flash('Unable to update Artist!')
@@ -424,16 +591,18 @@ def edit_artist_submission(artist_id):
       flash(field + ' - ' + str(message), 'danger')
     return redirect(url_for('edit_artist', artist_id=artist_id))
 
-@app.route('/artists/create', methods=['GET'])
+@route('/artists/create', methods=['GET'])
 def create_artist_form():
+  from forms import ArtistForm
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
-@app.route('/artists/create', methods=['POST'])
+@route('/artists/create', methods=['POST'])
 def create_artist_submission():
   # called upon submitting the new artist listing form
   # done: insert form data as a new Venue record in the db, instead
   # done: modify data to be the data object returned from db insertion
+  from forms import ArtistForm
   form = ArtistForm(request.form)
   error = False
 
@@ -465,7 +634,7 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@route('/shows')
 def shows():
   # displays list of shows at /shows
   # Done: replace with real venues data.
@@ -485,16 +654,30 @@ def shows():
     data.append(show_dict)
   return render_template('pages/shows.html', shows=data)
 
-@app.route('/shows/create')
+@route('/shows/stream')
+def shows_stream():
+  # server-sent events for displays that keep /shows open; see events.py
+  last_id = request.headers.get('Last-Event-ID', type=int)
+  if last_id is None:
+    last_id = show_events.last_id()
+  return Response(stream(last_id), mimetype='text/event-stream', headers={
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',
+  })
+
+@route('/shows/create')
 def create_shows():
   # renders form. do not touch.
+  from forms import ShowForm
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
-@app.route('/shows/create', methods=['POST'])
+@route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   # Done: insert form data as a new Show record in the db, instead
+  from forms import ShowForm
+  from rollups import record_show
   form = ShowForm(request.form)
   error = False
   
@@ -502,7 +685,9 @@ def create_show_submission():
     show = Shows()
     form.populate_obj(show)
     db.session.add(show)
+    record_show(show)
     db.session.commit()
+    publish_shows('created', [show.id])
   except:
     error = True
     db.session.rollback()
@@ -516,36 +701,77 @@ def create_show_submission():
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
     return render_template('pages/home.html')
 
-@app.errorhandler(404)
+#  Partial updates
+#  ----------------------------------------------------------------
+
+def patch_response(kind, id, listed):
+  # JSON partial update; `listed` are the fields show listings display.
+  # See patches.py.
+  from patches import patch, show_ids, Conflict, Invalid
+  changes = request.get_json(silent=True)
+  if not isinstance(changes, dict) or not isinstance(changes.get('version'), int):
+    abort(400)
+  version = changes.pop('version')
+  try:
+    row = patch(kind, id, changes, version)
+  except Invalid as e:
+    return jsonify({'errors': e.errors}), 400
+  except Conflict as e:
+    return jsonify({'error': 'version conflict', 'version': e.version}), 409
+  finally:
+    db.session.close()
+  if row is None:
+    abort(404)
+  if any(name in changes for name in listed):
+    publish_shows('updated', lambda: show_ids(kind, id))
+    db.session.close()
+  return jsonify(row)
+
+#  Calendars
+#  ----------------------------------------------------------------
+
+def calendar_response(kind, id):
+  # iCalendar feed for calendar apps; see calendars.py
+  from calendars import fingerprint, calendar
+  found = fingerprint(kind, id)
+  if found is None:
+    abort(404)
+  etag, title = found
+  if request.if_none_match.contains(etag):
+    response = Response(status=304)
+  else:
+    response = Response(calendar(kind, id, etag, title), mimetype='text/calendar')
+  response.set_etag(etag)
+  response.cache_control.public = True
+  response.cache_control.max_age = current_app.config.get('CALENDAR_MAX_AGE', 300)
+  return response
+
+@route('/metrics')
+def metrics_report():
+  # this process's timers (template compile/render, ...)
+  from metrics import metrics
+  return jsonify(metrics.snapshot())
+
+@errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
 
 # Default port:
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
 
 # Or specify port manually:
 '''
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
 '''
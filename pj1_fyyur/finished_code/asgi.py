@@ -0,0 +1,79 @@
+#----------------------------------------------------------------------------#
+# ASGI entry point.
+#
+#   uvicorn asgi:app --workers 4
+#
+# The read-only pages (home, venue/artist/show lists and venue/artist
+# details) are served by a Quart app on the async data layer in
+# async_queries.py, with the same templates and endpoint names as app.py.
+# Every other request (forms, POSTs, JSON endpoints, static files) goes to
+# the regular Flask app through WsgiToAsgi, so both stacks run side by side.
+#----------------------------------------------------------------------------#
+
+import re
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, abort, render_template
+import async_queries
+from app import create_app, format_datetime
+
+flask_app = create_app()
+wsgi = WsgiToAsgi(flask_app)
+
+pages = Quart(__name__)
+pages.config.from_object('config')
+pages.jinja_env.filters['datetime'] = format_datetime
+
+ASYNC_PAGES = re.compile(r'^/(venues|artists|shows|venues/\d+|artists/\d+)?$')
+
+@pages.before_serving
+async def connect():
+  async_queries.init_engine(pages.config)
+
+@pages.after_serving
+async def disconnect():
+  await async_queries.dispose_engine()
+
+@pages.route('/')
+async def index():
+  return await render_template('pages/home.html')
+
+@pages.route('/venues')
+async def venues():
+  return await render_template('pages/venues.html', areas=await async_queries.venue_areas())
+
+@pages.route('/venues/<int:venue_id>')
+async def show_venue(venue_id):
+  data = await async_queries.venue_detail(venue_id)
+  if data is None:
+    abort(404)
+  return await render_template('pages/show_venue.html', venue=data)
+
+@pages.route('/artists')
+async def artists():
+  return await render_template('pages/artists.html', artists=await async_queries.artist_list())
+
+@pages.route('/artists/<int:artist_id>')
+async def show_artist(artist_id):
+  data = await async_queries.artist_detail(artist_id)
+  if data is None:
+    abort(404)
+  return await render_template('pages/show_artist.html', artist=data)
+
+@pages.route('/shows')
+async def shows():
+  return await render_template('pages/shows.html', shows=await async_queries.show_list())
+
+@pages.errorhandler(404)
+async def not_found_error(error):
+  return await render_template('errors/404.html'), 404
+
+@pages.errorhandler(500)
+async def server_error(error):
+  return await render_template('errors/500.html'), 500
+
+async def app(scope, receive, send):
+  if scope['type'] == 'lifespan' or (
+      scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD') and ASYNC_PAGES.match(scope['path'])):
+    await pages(scope, receive, send)
+  else:
+    await wsgi(scope, receive, send)
@@ -0,0 +1,153 @@
+#----------------------------------------------------------------------------#
+# Async data access for the ASGI pages (see asgi.py).
+#
+# Same tables as models.py, read through SQLAlchemy's asyncio engine on
+# asyncpg. A page's independent queries each take their own pooled
+# connection and run together with asyncio.gather(), so a detail page waits
+# for its slowest query instead of the sum of them.
+#----------------------------------------------------------------------------#
+
+import asyncio
+from datetime import datetime
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from models import Venue, Artist, Shows, Similarity
+
+engine = None
+
+def init_engine(config):
+  global engine
+  uri = config.get('ASYNC_DATABASE_URI') or \
+    config['SQLALCHEMY_DATABASE_URI'].replace('postgresql://', 'postgresql+asyncpg://', 1)
+  engine = create_async_engine(uri, pool_size=config.get('ASYNC_POOL_SIZE', 10), pool_pre_ping=True)
+  return engine
+
+async def dispose_engine():
+  if engine is not None:
+    await engine.dispose()
+
+async def fetch_all(statement):
+  async with engine.connect() as connection:
+    return (await connection.execute(statement)).fetchall()
+
+async def fetch_one(statement):
+  async with engine.connect() as connection:
+    return (await connection.execute(statement)).first()
+
+def _show_tiles(rows, prefix):
+  return [{
+    prefix + '_id': row[0],
+    prefix + '_name': row[1],
+    prefix + '_image_link': row[2],
+    'start_time': str(row[3]),
+  } for row in rows]
+
+def _similar(rows):
+  return [{'id': row[0], 'name': row[1], 'image_link': row[2]} for row in rows]
+
+async def venue_detail(venue_id):
+  now = datetime.now()
+  shows = select(Shows.artist_id, Artist.name, Artist.image_link, Shows.start_time)\
+    .join(Artist, Artist.id == Shows.artist_id).where(Shows.venue_id == venue_id)
+  venue, past, upcoming, similar = await asyncio.gather(
+    fetch_one(select(Venue.__table__).where(Venue.id == venue_id)),
+    fetch_all(shows.where(Shows.start_time < now)),
+    fetch_all(shows.where(Shows.start_time >= now)),
+    fetch_all(select(Venue.id, Venue.name, Venue.image_link)
+              .join(Similarity, Similarity.neighbour_id == Venue.id)
+              .where(Similarity.kind == 'venue', Similarity.entity_id == venue_id)
+              .order_by(Similarity.rank)),
+  )
+  if venue is None:
+    return None
+  past_shows, upcoming_shows = _show_tiles(past, 'artist'), _show_tiles(upcoming, 'artist')
+  return {
+    "id": venue.id,
+    "name": venue.name,
+    "genres": venue.genres,
+    "address": venue.address,
+    "city": venue.city,
+    "state": venue.state,
+    "phone": venue.phone,
+    "website": venue.website_link,
+    "facebook_link": venue.facebook_link,
+    "seeking_talent": venue.seeking_talent,
+    "seeking_description": venue.seeking_description,
+    "image_link": venue.image_link,
+    "past_shows": past_shows,
+    "upcoming_shows": upcoming_shows,
+    "past_shows_count": len(past_shows),
+    "upcoming_shows_count": len(upcoming_shows),
+    "similar_venues": _similar(similar),
+  }
+
+async def artist_detail(artist_id):
+  now = datetime.now()
+  shows = select(Shows.venue_id, Venue.name, Venue.image_link, Shows.start_time)\
+    .join(Venue, Venue.id == Shows.venue_id).where(Shows.artist_id == artist_id)
+  artist, past, upcoming, similar = await asyncio.gather(
+    fetch_one(select(Artist.__table__).where(Artist.id == artist_id)),
+    fetch_all(shows.where(Shows.start_time < now)),
+    fetch_all(shows.where(Shows.start_time >= now)),
+    fetch_all(select(Artist.id, Artist.name, Artist.image_link)
+              .join(Similarity, Similarity.neighbour_id == Artist.id)
+              .where(Similarity.kind == 'artist', Similarity.entity_id == artist_id)
+              .order_by(Similarity.rank)),
+  )
+  if artist is None:
+    return None
+  past_shows, upcoming_shows = _show_tiles(past, 'venue'), _show_tiles(upcoming, 'venue')
+  return {
+    "id": artist.id,
+    "name": artist.name,
+    "genres": artist.genres,
+    "city": artist.city,
+    "state": artist.state,
+    "phone": artist.phone,
+    "website": artist.website_link,
+    "facebook_link": artist.facebook_link,
+    "seeking_venue": artist.seeking_venue,
+    "seeking_description": artist.seeking_description,
+    "image_link": artist.image_link,
+    "past_shows": past_shows,
+    "upcoming_shows": upcoming_shows,
+    "past_shows_count": len(past_shows),
+    "upcoming_shows_count": len(upcoming_shows),
+    "similar_artists": _similar(similar),
+  }
+
+async def venue_areas():
+  upcoming = func.count(Shows.id).filter(Shows.start_time > datetime.now())
+  rows = await fetch_all(
+    select(Venue.city, Venue.state, Venue.id, Venue.name, upcoming)
+      .outerjoin(Shows, Shows.venue_id == Venue.id)
+      .group_by(Venue.id)
+      .order_by(Venue.state, Venue.city, Venue.id))
+  areas = []
+  for city, state, id, name, num_upcoming_shows in rows:
+    if not areas or (areas[-1]['city'], areas[-1]['state']) != (city, state):
+      areas.append({'city': city, 'state': state, 'venues': []})
+    areas[-1]['venues'].append({'id': id, 'name': name, 'num_upcoming_shows': num_upcoming_shows})
+  return areas
+
+async def artist_list():
+  upcoming = func.count(Shows.id).filter(Shows.start_time >= datetime.now())
+  rows = await fetch_all(
+    select(Artist.id, Artist.name, upcoming)
+      .outerjoin(Shows, Shows.artist_id == Artist.id)
+      .group_by(Artist.id)
+      .order_by(Artist.id))
+  return [{'id': id, 'name': name, 'num_upcoming_shows': num_upcoming_shows} for id, name, num_upcoming_shows in rows]
+
+async def show_list():
+  rows = await fetch_all(
+    select(Venue.name, Artist.name, Artist.image_link, Shows.venue_id, Shows.artist_id, Shows.start_time)
+      .where(Venue.id == Shows.venue_id, Artist.id == Shows.artist_id))
+  return [{
+    'venue_name': show[0],
+    'artist_name': show[1],
+    'artist_image_link': show[2],
+    'venue_id': show[3],
+    'artist_id': show[4],
+    'start_time': str(show[5]),
+  } for show in rows]
@@ -0,0 +1,75 @@
+#----------------------------------------------------------------------------#
+# Concurrency benchmark: sync WSGI pages against the async ASGI pages.
+#
+# Start both stacks with the same number of workers, e.g.
+#
+#   gunicorn -c gunicorn.conf.py -w 4 -b 127.0.0.1:5000 wsgi:app
+#   uvicorn asgi:app --workers 4 --port 5001
+#
+# then run
+#
+#   python bench_concurrency.py --concurrency 64 --requests 2000 \
+#       http://127.0.0.1:5000 http://127.0.0.1:5001
+#
+# Each base URL gets the same mix of detail and list pages from a pool of
+# client threads; throughput and latency percentiles are printed as JSON.
+#----------------------------------------------------------------------------#
+
+import argparse
+import itertools
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PATHS = ['/venues/1', '/artists/1', '/venues', '/artists', '/shows']
+
+
+def fetch(url):
+  started = time.perf_counter()
+  try:
+    with urllib.request.urlopen(url, timeout=30) as response:
+      response.read()
+      ok = response.status == 200
+  except Exception:
+    ok = False
+  return time.perf_counter() - started, ok
+
+
+def run(base_url, paths, concurrency, requests):
+  urls = itertools.islice(itertools.cycle(base_url.rstrip('/') + path for path in paths), requests)
+  started = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as pool:
+    results = list(pool.map(fetch, urls))
+  elapsed = time.perf_counter() - started
+  latencies = sorted(latency * 1000 for latency, ok in results if ok)
+  percentile = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 2) if latencies else None
+  return {
+    'requests': requests,
+    'errors': sum(1 for _, ok in results if not ok),
+    'requests_per_second': round(requests / elapsed, 1),
+    'p50_ms': percentile(0.50),
+    'p95_ms': percentile(0.95),
+    'p99_ms': percentile(0.99),
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Fyyur WSGI vs ASGI concurrency benchmark.')
+  parser.add_argument('base_urls', nargs='+')
+  parser.add_argument('--concurrency', type=int, default=32)
+  parser.add_argument('--requests', type=int, default=1000)
+  parser.add_argument('--path', action='append', dest='paths',
+                      help='page to request (repeatable); defaults to detail and list pages')
+  args = parser.parse_args()
+
+  paths = args.paths or DEFAULT_PATHS
+  report = {}
+  for base_url in args.base_urls:
+    run(base_url, paths, args.concurrency, min(args.requests, 50))  # warm up
+    report[base_url] = run(base_url, paths, args.concurrency, args.requests)
+  print(json.dumps({'concurrency': args.concurrency, 'paths': paths, 'results': report}, indent=2))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,68 @@
+#----------------------------------------------------------------------------#
+# Search benchmark: unified /search against /venues/search + /artists/search.
+#
+#   python bench_search.py [--runs 50] Music "San Francisco" ...
+#
+# Runs against the database configured in config.py, through the test
+# client, and reports latency and SQL statements per search.
+#----------------------------------------------------------------------------#
+
+import argparse
+import json
+import statistics
+import time
+from urllib.parse import urlencode
+from sqlalchemy import event
+from app import create_app
+from models import db
+
+
+def measure(client, counter, requests, runs):
+  timings, queries = [], []
+  for _ in range(runs):
+    counter['statements'] = 0
+    started = time.perf_counter()
+    for method, path, data in requests:
+      response = client.open(path, method=method, data=data)
+      assert response.status_code == 200, (path, response.status_code)
+    timings.append((time.perf_counter() - started) * 1000)
+    queries.append(counter['statements'])
+  timings.sort()
+  return {
+    'median_ms': round(statistics.median(timings), 2),
+    'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 2),
+    'statements': max(queries),
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Fyyur search benchmark.')
+  parser.add_argument('terms', nargs='*', default=['a', 'Music', 'San Francisco'])
+  parser.add_argument('--runs', type=int, default=50)
+  args = parser.parse_args()
+
+  app = create_app()
+  app.config['SQLALCHEMY_ECHO'] = False
+  client = app.test_client()
+  counter = {'statements': 0}
+  with app.app_context():
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def count(*args):
+      counter['statements'] += 1
+
+  report = {}
+  for term in args.terms:
+    separate = [
+      ('POST', '/venues/search', {'search_term': term}),
+      ('POST', '/artists/search', {'search_term': term}),
+    ]
+    unified = [('GET', '/search?' + urlencode({'search_term': term}), None)]
+    report[term] = {
+      'venues+artists': measure(client, counter, separate, args.runs),
+      'unified': measure(client, counter, unified, args.runs),
+    }
+  print(json.dumps({'runs': args.runs, 'results': report}, indent=2))
+
+
+if __name__ == '__main__':
+  main()
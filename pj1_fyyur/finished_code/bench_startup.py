@@ -0,0 +1,70 @@
+#----------------------------------------------------------------------------#
+# Startup-time benchmark.
+#
+#   python bench_startup.py [--runs 10] [--path /]
+#
+# Every run starts a fresh interpreter and reports how long it takes to
+# import the app module, build the app, and serve the first and second
+# request through the test client.
+#----------------------------------------------------------------------------#
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CHILD = '''
+import json, sys, time
+t0 = time.perf_counter()
+import app as fyyur
+t1 = time.perf_counter()
+application = fyyur.create_app()
+if {preload}:
+    fyyur.preload(application)
+t2 = time.perf_counter()
+client = application.test_client()
+client.get({path!r})
+t3 = time.perf_counter()
+client.get({path!r})
+t4 = time.perf_counter()
+json.dump({{
+    'import_ms': (t1 - t0) * 1000,
+    'create_app_ms': (t2 - t1) * 1000,
+    'first_request_ms': (t3 - t2) * 1000,
+    'second_request_ms': (t4 - t3) * 1000,
+}}, sys.stdout)
+'''
+
+
+def run_once(path, preload):
+  output = subprocess.check_output(
+      [sys.executable, '-c', CHILD.format(path=path, preload=preload)],
+      cwd=os.path.dirname(os.path.abspath(__file__)),
+  )
+  return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Fyyur startup-time benchmark.')
+  parser.add_argument('--runs', type=int, default=10)
+  parser.add_argument('--path', default='/')
+  parser.add_argument('--preload', action='store_true',
+                      help='call preload() before the first request, as wsgi.py does')
+  args = parser.parse_args()
+
+  samples = [run_once(args.path, args.preload) for _ in range(args.runs)]
+  report = {}
+  for key in samples[0]:
+    values = [sample[key] for sample in samples]
+    report[key] = {
+        'median': round(statistics.median(values), 2),
+        'min': round(min(values), 2),
+        'max': round(max(values), 2),
+    }
+  print(json.dumps({'runs': args.runs, 'path': args.path, 'preload': args.preload, 'results': report}, indent=2))
+
+
+if __name__ == '__main__':
+  main()
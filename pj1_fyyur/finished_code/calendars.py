@@ -0,0 +1,120 @@
+#----------------------------------------------------------------------------#
+# iCalendar feeds.
+#
+# /venues/<id>/calendar.ics and /artists/<id>/calendar.ics list a venue's or
+# artist's shows from CALENDAR_PAST_DAYS ago onwards. Every request first
+# reads a fingerprint of the feed (the entity's own fields, the count and
+# highest id of its shows in range, and the summed versions of the artists or
+# venues booked for them, which go up whenever one of those is edited) with
+# one aggregate over the (venue_id, start_time) / (artist_id, start_time)
+# index and the other side's primary key. The fingerprint is
+# the ETag, so most polls end in a 304 without building anything, and the
+# feed itself is rebuilt (one range query over the same index) only when the
+# fingerprint changes.
+#----------------------------------------------------------------------------#
+
+import collections
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from flask import current_app, url_for
+from sqlalchemy import and_, func
+from models import db, Venue, Artist, Shows
+
+FEEDS = {
+  # model, fields that appear in the feed (name first), column in Shows,
+  # the other side of the booking and its column in Shows
+  'venue': (Venue, (Venue.name, Venue.address, Venue.city, Venue.state), Shows.venue_id,
+            Artist, Shows.artist_id),
+  'artist': (Artist, (Artist.name, Artist.city, Artist.state), Shows.artist_id,
+             Venue, Shows.venue_id),
+}
+
+_feeds = collections.OrderedDict()
+_lock = threading.Lock()
+
+def fingerprint(kind, id):
+  # (etag, feed title) for the entity's feed, or None when it does not exist.
+  model, fields, column, other, other_column = FEEDS[kind]
+  row = db.session.query(*fields, func.count(Shows.id), func.max(Shows.id), func.sum(other.version))\
+    .outerjoin(Shows, and_(column == model.id, Shows.start_time >= _since()))\
+    .outerjoin(other, other.id == other_column)\
+    .filter(model.id == id).group_by(model.id).first()
+  if row is None:
+    return None
+  return hashlib.md5(repr((kind, id) + tuple(row)).encode('utf-8')).hexdigest(), row[0]
+
+def calendar(kind, id, etag, title):
+  # The feed's ics text, rebuilt only when `etag` differs from the cached one.
+  with _lock:
+    feed = _feeds.get((kind, id))
+    if feed is not None and feed[0] == etag:
+      _feeds.move_to_end((kind, id))
+      return feed[1]
+
+  column = FEEDS[kind][2]
+  shows = db.session.query(Shows.id, Shows.start_time, Shows.venue_id, Shows.artist_id, Artist.name,
+                           Venue.name, Venue.address, Venue.city, Venue.state)\
+    .join(Venue, Venue.id == Shows.venue_id).join(Artist, Artist.id == Shows.artist_id)\
+    .filter(column == id, Shows.start_time >= _since())\
+    .order_by(Shows.start_time, Shows.id).all()
+  body = render(kind, title, shows)
+  with _lock:
+    _feeds[(kind, id)] = (etag, body)
+    _feeds.move_to_end((kind, id))
+    while len(_feeds) > current_app.config.get('CALENDAR_CACHE_SIZE', 512):
+      _feeds.popitem(last=False)
+  return body
+
+def _since():
+  return datetime.now() - timedelta(days=current_app.config.get('CALENDAR_PAST_DAYS', 30))
+
+def render(kind, title, shows):
+  # Shows have naive local start times, so they are written as floating times.
+  length = timedelta(hours=current_app.config.get('CALENDAR_SHOW_HOURS', 2))
+  stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+  host = current_app.config.get('SERVER_NAME') or 'fyyur'
+  lines = [
+    'BEGIN:VCALENDAR',
+    'VERSION:2.0',
+    'PRODID:-//Fyyur//Shows//EN',
+    'CALSCALE:GREGORIAN',
+    'METHOD:PUBLISH',
+    'X-WR-CALNAME:' + escape(title),
+  ]
+  for id, start_time, venue_id, artist_id, artist_name, venue_name, address, city, state in shows:
+    # link to the other side of the booking
+    page = url_for('show_artist', artist_id=artist_id, _external=True) if kind == 'venue' \
+      else url_for('show_venue', venue_id=venue_id, _external=True)
+    lines += [
+      'BEGIN:VEVENT',
+      'UID:show-%d@%s' % (id, host),
+      'DTSTAMP:' + stamp,
+      'DTSTART:' + start_time.strftime('%Y%m%dT%H%M%S'),
+      'DTEND:' + (start_time + length).strftime('%Y%m%dT%H%M%S'),
+      'SUMMARY:' + escape('%s at %s' % (artist_name, venue_name)),
+      'LOCATION:' + escape(', '.join(part for part in (venue_name, address, city, state) if part)),
+      'URL:' + page,
+      'END:VEVENT',
+    ]
+  lines.append('END:VCALENDAR')
+  return ''.join(fold(line) + '\r\n' for line in lines)
+
+def escape(value):
+  return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')\
+    .replace('\r\n', '\\n').replace('\n', '\\n')
+
+def fold(line):
+  # Content lines are at most 75 octets; continuations start with a space.
+  # Never split inside a UTF-8 sequence.
+  encoded = line.encode('utf-8')
+  if len(encoded) <= 75:
+    return line
+  parts, start, limit = [], 0, 75
+  while start < len(encoded):
+    end = min(start + limit, len(encoded))
+    while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+      end -= 1
+    parts.append(encoded[start:end].decode('utf-8'))
+    start, limit = end, 74
+  return '\r\n '.join(parts)
@@ -0,0 +1,173 @@
+#----------------------------------------------------------------------------#
+# Live show events.
+#
+# Controllers publish 'created' / 'updated' / 'deleted' events for shows and
+# /shows/stream relays them to browsers as server-sent events. Every
+# subscriber of a process reads the same small ring buffer, so an idle
+# display costs one waiting thread (or greenlet) and no queries.
+#
+# SHOW_EVENTS_BACKEND = 'local' delivers events inside the publishing
+# process only. 'postgres' sends them through NOTIFY; each worker LISTENs
+# once and feeds its own buffer, so events reach subscribers on any worker.
+# Event ids then come from one Postgres sequence, so a browser resuming with
+# Last-Event-ID on another worker is given the events it actually missed.
+#----------------------------------------------------------------------------#
+
+import collections
+import json
+import select
+import threading
+import time
+from flask import current_app
+from sqlalchemy import text
+from models import db, Venue, Artist, Shows
+
+CHANNEL = 'fyyur_shows'
+SEQUENCE = 'fyyur_show_events'
+# The advisory lock makes publishers take turns, so ids are committed, and
+# reach the listeners, in order.
+NOTIFY = text('''
+  SELECT pg_notify(:channel, json_build_object(
+    'id', nextval('%s'), 'event', :event, 'data', CAST(:data AS json))::text)
+''' % SEQUENCE)
+
+class ShowEvents:
+
+  def __init__(self, app=None, history=256):
+    self.backend = 'local'
+    self.heartbeat = 15
+    self.database_uri = None
+    self._events = collections.deque(maxlen=history)
+    self._last_id = 0
+    self._condition = threading.Condition()
+    self._listener = None
+    self._sequence = False
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    self.backend = app.config.get('SHOW_EVENTS_BACKEND', 'local')
+    self.heartbeat = app.config.get('SHOW_EVENTS_HEARTBEAT', 15)
+    self.database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+    app.extensions['show_events'] = self
+
+  def publish(self, event, payloads):
+    # Call after the change is committed.
+    if not payloads:
+      return
+    if self.backend == 'postgres':
+      with db.engine.begin() as connection:
+        if not self._sequence:
+          connection.execute(text('CREATE SEQUENCE IF NOT EXISTS ' + SEQUENCE))
+          self._sequence = True
+        connection.execute(text('SELECT pg_advisory_xact_lock(hashtext(:channel))'), {'channel': CHANNEL})
+        for payload in payloads:
+          connection.execute(NOTIFY, {
+            'channel': CHANNEL,
+            'event': event,
+            'data': json.dumps(payload),
+          })
+    else:
+      with self._condition:
+        self._append([(self._last_id + i, event, payload) for i, payload in enumerate(payloads, 1)])
+
+  def last_id(self):
+    return self._last_id
+
+  def wait(self, after, timeout):
+    # Events newer than `after`, blocking up to `timeout` seconds for one.
+    self._ensure_listener()
+    with self._condition:
+      if after > self._last_id:
+        # an id this process has not seen yet (it started listening later,
+        # or restarted): start from now
+        after = self._last_id
+      if after == self._last_id:
+        self._condition.wait(timeout)
+      return [entry for entry in self._events if entry[0] > after]
+
+  def _append(self, events):
+    # events are (id, event, payload) in id order
+    with self._condition:
+      for entry in events:
+        self._events.append(entry)
+        self._last_id = entry[0]
+      self._condition.notify_all()
+
+  def _ensure_listener(self):
+    # Started on the first subscription, i.e. inside a worker and never in a
+    # prefork master, so the LISTEN connection is not shared across forks.
+    if self.backend != 'postgres' or self._listener is not None:
+      return
+    with self._condition:
+      if self._listener is None:
+        self._listener = threading.Thread(target=self._listen, name='show-events', daemon=True)
+        self._listener.start()
+
+  def _listen(self):
+    import psycopg2
+
+    while True:
+      connection = None
+      try:
+        connection = psycopg2.connect(self.database_uri)
+        connection.set_session(autocommit=True)
+        connection.cursor().execute('LISTEN ' + CHANNEL)
+        while True:
+          if select.select([connection], [], [], self.heartbeat) == ([], [], []):
+            continue
+          connection.poll()
+          events = []
+          while connection.notifies:
+            message = json.loads(connection.notifies.pop(0).payload)
+            events.append((message['id'], message['event'], message['data']))
+          self._append(events)
+      except Exception:
+        if connection is not None:
+          connection.close()
+        time.sleep(1)
+
+show_events = ShowEvents()
+
+def show_payloads(show_ids):
+  # Everything a show listing needs, so displays never query back.
+  if not show_ids:
+    return []
+  shows = db.session.query(Shows.id, Shows.venue_id, Venue.name, Shows.artist_id, Artist.name,
+                           Artist.image_link, Shows.start_time)\
+    .join(Venue, Venue.id == Shows.venue_id).join(Artist, Artist.id == Shows.artist_id)\
+    .filter(Shows.id.in_(show_ids)).all()
+  return [{
+    'id': show[0],
+    'venue_id': show[1],
+    'venue_name': show[2],
+    'artist_id': show[3],
+    'artist_name': show[4],
+    'artist_image_link': show[5],
+    'start_time': str(show[6]),
+  } for show in shows]
+
+def publish_shows(event, show_ids):
+  # Call after the change is committed. The change has succeeded by then,
+  # so a failure to build or send the events is logged, not raised.
+  # `show_ids` may be a function returning them, to load them inside the guard.
+  try:
+    if callable(show_ids):
+      show_ids = show_ids()
+    if event == 'deleted':
+      payloads = [{'id': show_id} for show_id in show_ids]
+    else:
+      payloads = show_payloads(show_ids)
+    show_events.publish(event, payloads)
+  except Exception:
+    current_app.logger.exception('could not publish %s shows', event)
+
+def stream(last_id):
+  yield 'retry: 5000\n\n'
+  while True:
+    events = show_events.wait(last_id, show_events.heartbeat)
+    if not events:
+      yield ': keep-alive\n\n'
+      continue
+    for last_id, event, payload in events:
+      yield 'id: %d\nevent: %s\ndata: %s\n\n' % (last_id, event, json.dumps(payload))
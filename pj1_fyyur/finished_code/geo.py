@@ -0,0 +1,110 @@
+#----------------------------------------------------------------------------#
+# Venue locations.
+#
+# Venues get latitude/longitude from the bundled gazetteer (data/
+# gazetteer.csv: city, state, latitude, longitude), looked up by city and
+# state. Nearby search orders by ll_to_earth() distance with the <-> operator
+# so Postgres walks the GiST index created by `flask geo init` instead of
+# measuring every venue.
+#----------------------------------------------------------------------------#
+
+import click
+import csv
+from datetime import datetime
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, func, text, update
+from models import db, Venue, Shows
+
+_gazetteer = {}
+
+def gazetteer():
+  path = current_app.config['GAZETTEER_PATH']
+  if path not in _gazetteer:
+    with open(path, newline='') as f:
+      _gazetteer[path] = {
+        (row['city'].strip().lower(), row['state'].strip().upper()):
+          (float(row['latitude']), float(row['longitude']))
+        for row in csv.DictReader(f)
+      }
+  return _gazetteer[path]
+
+def lookup(city, state):
+  return gazetteer().get(((city or '').strip().lower(), (state or '').strip().upper()))
+
+def locate(venue):
+  # Set (or clear) a venue's coordinates from its city and state.
+  venue.latitude, venue.longitude = lookup(venue.city, venue.state) or (None, None)
+
+def geocode(everything=False):
+  # Fill coordinates for venues that have none (or all venues), in one
+  # transaction; like locate(), a venue that is not found is cleared.
+  # Returns (located, not found).
+  venues = db.session.query(Venue.id, Venue.city, Venue.state)
+  if not everything:
+    venues = venues.filter(Venue.latitude.is_(None))
+  updates, missing = [], 0
+  for id, city, state in venues.all():
+    point = lookup(city, state)
+    if point is None:
+      missing += 1
+      if not everything:
+        continue
+      point = (None, None)
+    updates.append({'venue_id': id, 'latitude': point[0], 'longitude': point[1]})
+  try:
+    # Coordinates follow from city/state, so they don't bump Venue.version.
+    if updates:
+      db.session.execute(
+        update(Venue.__table__).where(Venue.__table__.c.id == bindparam('venue_id')),
+        updates)
+    db.session.commit()
+  except:
+    db.session.rollback()
+    raise
+  finally:
+    db.session.close()
+  return len(updates) - (missing if everything else 0), missing
+
+def nearby_venues(latitude, longitude, k=10):
+  now = datetime.now()
+  location = func.ll_to_earth(Venue.latitude, Venue.longitude)
+  origin = func.ll_to_earth(latitude, longitude)
+  upcoming = db.session.query(func.count(Shows.id))\
+    .filter(Shows.venue_id == Venue.id, Shows.start_time > now).scalar_subquery()
+  venues = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state,
+                            func.earth_distance(location, origin), upcoming)\
+    .filter(Venue.latitude.isnot(None))\
+    .order_by(location.op('<->')(origin))\
+    .limit(k).all()
+  return [{
+    'id': venue[0],
+    'name': venue[1],
+    'city': venue[2],
+    'state': venue[3],
+    'distance_km': round(venue[4] / 1000, 1),
+    'num_upcoming_shows': venue[5],
+  } for venue in venues]
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+geo_cli = AppGroup('geo', help='Venue coordinates and the nearest-venue index.')
+
+@geo_cli.command('init')
+def init_command():
+  """Install cube/earthdistance and index venue locations (idempotent)."""
+  db.session.execute(text('CREATE EXTENSION IF NOT EXISTS cube'))
+  db.session.execute(text('CREATE EXTENSION IF NOT EXISTS earthdistance'))
+  db.session.execute(text(
+    'CREATE INDEX IF NOT EXISTS ix_venue_earth ON "Venue" USING gist (ll_to_earth(latitude, longitude))'))
+  db.session.commit()
+  click.echo('Venue location index is ready.')
+
+@geo_cli.command('geocode')
+@click.option('--all', 'everything', is_flag=True, help='Re-locate every venue, not only those without coordinates.')
+def geocode_command(everything):
+  """Fill venue coordinates from the bundled gazetteer."""
+  located, missing = geocode(everything)
+  click.echo('Located %d venues; %d not found in the gazetteer.' % (located, missing))
@@ -0,0 +1,28 @@
+#----------------------------------------------------------------------------#
+# Gunicorn settings for serving wsgi:app.
+#----------------------------------------------------------------------------#
+
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:' + os.environ.get('PORT', '5000'))
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Threaded workers: an open /shows/stream holds one thread rather than the
+# whole worker, and the worker keeps answering the master's heartbeat while
+# it streams, so long-lived streams are not killed by `timeout`.
+worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('THREADS', 32))
+
+# Load wsgi:app (and everything preload() imports) in the master so workers
+# start from shared, already-imported memory.
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Database connections must never be shared between processes. Drop any
+    # pooled connection the master opened so each worker builds its own.
+    from wsgi import app
+    from models import db
+
+    with app.app_context():
+        db.engine.dispose()
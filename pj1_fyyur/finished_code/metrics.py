@@ -0,0 +1,42 @@
+#----------------------------------------------------------------------------#
+# In-process metrics.
+#
+# Named timers (count, total, max) kept per process and served as JSON at
+# /metrics. Each worker reports its own numbers.
+#----------------------------------------------------------------------------#
+
+import threading
+import time
+from contextlib import contextmanager
+
+class Metrics:
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._timers = {}
+
+  def observe(self, name, seconds):
+    with self._lock:
+      timer = self._timers.setdefault(name, [0, 0.0, 0.0])
+      timer[0] += 1
+      timer[1] += seconds
+      timer[2] = max(timer[2], seconds)
+
+  @contextmanager
+  def timer(self, name):
+    started = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(name, time.perf_counter() - started)
+
+  def snapshot(self):
+    with self._lock:
+      return {name: {
+        'count': count,
+        'total_ms': round(total * 1000, 3),
+        'mean_ms': round(total * 1000 / count, 3),
+        'max_ms': round(longest * 1000, 3),
+      } for name, (count, total, longest) in sorted(self._timers.items())}
+
+metrics = Metrics()
@@ -18,7 +18,15 @@ class Venue(db.Model):
     genres = db.Column(db.ARRAY(db.String), nullable=False)
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(120))
+    # Filled from city/state by geo.locate(); indexed with earthdistance by
+    # `flask geo init`.
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # Bumped by every update; PATCH /venues/<id> only applies to the version
+    # the client last saw (see patches.py).
+    version = db.Column(db.Integer, nullable=False, server_default='1')
     shows = db.relationship('Shows', backref=db.backref('Venue'), lazy='joined', cascade="all, delete-orphan")
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
       return f'<Venue {self.id}, {self.name}>'
@@ -51,7 +59,10 @@ class Artist(db.Model):
     website_link = db.Column(db.String(500))
     seeking_venue = db.Column(db.Boolean())
     seeking_description = db.Column(db.String(120))
+    # Bumped by every update; see Venue.version.
+    version = db.Column(db.Integer, nullable=False, server_default='1')
     shows = db.relationship('Shows', backref=db.backref('Artist'), lazy='joined', cascade="all, delete-orphan")
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
       return f'<Artist {self.id}, {self.name}>'
@@ -74,6 +85,11 @@ class Artist(db.Model):
 
 class Shows(db.Model):
     __tablename__ = 'Shows'
+    # Range scans for one venue's or artist's shows by date (calendar feeds).
+    __table_args__ = (
+        db.Index('ix_shows_venue_start', 'venue_id', 'start_time'),
+        db.Index('ix_shows_artist_start', 'artist_id', 'start_time'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     venue_id = db.Column(db.Integer, db.ForeignKey(Venue.id), nullable=False)
@@ -82,3 +98,54 @@ class Shows(db.Model):
 
     def __repr__(self):
       return f'<Shows {self.id}>'
+
+class ShowRollup(db.Model):
+    # Per (venue, artist, month) show counts, kept up to date as shows are
+    # created (see rollups.record_show) so dashboards never scan Shows.
+    __tablename__ = 'ShowRollup'
+
+    venue_id = db.Column(db.Integer, db.ForeignKey(Venue.id, ondelete='CASCADE'), primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey(Artist.id, ondelete='CASCADE'), primary_key=True, index=True)
+    month = db.Column(db.Date, primary_key=True)
+    show_count = db.Column(db.Integer, nullable=False, default=0)
+    # Shows per ISO weekday, Monday first.
+    weekday_counts = db.Column(db.ARRAY(db.Integer), nullable=False)
+
+    def __repr__(self):
+      return f'<ShowRollup {self.venue_id}, {self.artist_id}, {self.month}>'
+
+class Similarity(db.Model):
+    # Precomputed nearest neighbours ("similar venues", "similar artists"),
+    # rebuilt offline by recommendations.rebuild(). kind is 'venue' or
+    # 'artist'; the primary key doubles as the lookup index for a page.
+    __tablename__ = 'Similarity'
+
+    kind = db.Column(db.String(6), primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    neighbour_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+      return f'<Similarity {self.kind} {self.entity_id} #{self.rank}: {self.neighbour_id}>'
+
+class SimilarityBuild(db.Model):
+    # Single row remembering the last show folded into Similarity, so the
+    # next rebuild only recomputes entities touched by newer shows.
+    __tablename__ = 'SimilarityBuild'
+
+    id = db.Column(db.Integer, primary_key=True)
+    last_show_id = db.Column(db.Integer, nullable=False, default=0)
+    built_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow)
+
+class SimilarityStale(db.Model):
+    # Venues and artists whose neighbours a deletion changed. Deleted shows
+    # never pass last_show_id, so recommendations.forget() queues them here
+    # and the next rebuild recomputes and clears them.
+    __tablename__ = 'SimilarityStale'
+
+    kind = db.Column(db.String(6), primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+
+    def __repr__(self):
+      return f'<SimilarityStale {self.kind} {self.entity_id}>'
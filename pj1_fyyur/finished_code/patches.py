@@ -0,0 +1,89 @@
+#----------------------------------------------------------------------------#
+# Partial updates.
+#
+# PATCH /venues/<id> and /artists/<id> take a JSON object with only the
+# fields that changed plus the `version` the client last saw. Just those
+# fields are validated, with the validators of the edit forms, and written
+# by one UPDATE ... WHERE id = :id AND version = :version RETURNING, so no
+# entity (or its shows) is loaded. The version column is also the mapper's
+# version_id_col, so edits through the forms bump it the same way.
+#----------------------------------------------------------------------------#
+
+from sqlalchemy import update
+from werkzeug.datastructures import MultiDict
+from models import db, Venue, Artist, Shows
+from geo import lookup
+
+class Conflict(Exception):
+  # The row exists but its version is not the one the client sent.
+  def __init__(self, version):
+    Exception.__init__(self, version)
+    self.version = version
+
+class Invalid(Exception):
+  def __init__(self, errors):
+    Exception.__init__(self, errors)
+    self.errors = errors
+
+def _forms():
+  from forms import VenueForm, ArtistForm
+  return {'venue': (Venue, VenueForm), 'artist': (Artist, ArtistForm)}
+
+def validate(form_class, changes):
+  # Run the form's validators for the submitted fields only; returns the
+  # converted values by column name.
+  formdata = MultiDict()
+  for name, value in changes.items():
+    for item in value if isinstance(value, list) else [value]:
+      formdata.add(name, '' if item is None else item)
+  form = form_class(formdata=formdata, meta={'csrf': False})
+  unknown = [name for name in changes if name not in form or name == 'csrf_token']
+  if unknown:
+    raise Invalid({name: ['Unknown field.'] for name in unknown})
+  errors = {}
+  for name in changes:
+    if not form[name].validate(form):
+      errors[name] = form[name].errors
+  if errors:
+    raise Invalid(errors)
+  return {name: form[name].data for name in changes}
+
+def patch(kind, id, changes, version):
+  # Apply `changes` if the row is still at `version`. Returns the updated
+  # row as a dict, None if there is no such row; raises Invalid or Conflict.
+  model, form_class = _forms()[kind]
+  values = validate(form_class, changes)
+  table = model.__table__
+  if kind == 'venue' and ('city' in values or 'state' in values):
+    # relocated below once the full new address is known
+    values['latitude'] = values['longitude'] = None
+  try:
+    row = db.session.execute(
+      update(table)
+        .where(table.c.id == id, table.c.version == version)
+        .values(version=table.c.version + 1, **values)
+        .returning(*table.c)
+    ).first()
+    if row is None:
+      current = db.session.query(model.version).filter(model.id == id).scalar()
+      db.session.rollback()
+      if current is None:
+        return None
+      raise Conflict(current)
+    row = dict(row._mapping)
+    if 'latitude' in values:
+      point = lookup(row['city'], row['state'])
+      if point is not None:
+        db.session.execute(update(table).where(table.c.id == id)
+                           .values(latitude=point[0], longitude=point[1]))
+        row['latitude'], row['longitude'] = point
+    db.session.commit()
+  except:
+    db.session.rollback()
+    raise
+  return row
+
+def show_ids(kind, id):
+  # Shows whose listings display fields of this venue/artist.
+  column = Shows.venue_id if kind == 'venue' else Shows.artist_id
+  return [show_id for show_id, in db.session.query(Shows.id).filter(column == id)]
@@ -0,0 +1,173 @@
+#----------------------------------------------------------------------------#
+# Similar venues and artists.
+#
+# Venues and artists are compared by who they book: a sparse venue x artist
+# matrix of show counts (read from ShowRollup) is L2-normalised and the
+# cosine similarity between rows (venues) or columns (artists) decides the
+# neighbours. Only the top neighbours are kept, in the Similarity table, so
+# a detail page needs a single primary-key lookup.
+#----------------------------------------------------------------------------#
+
+import click
+from datetime import datetime
+from flask.cli import AppGroup
+from models import db, Venue, Artist, Shows, ShowRollup, Similarity, SimilarityBuild, SimilarityStale
+
+TOP_K = 6
+# Rows of the similarity product computed at once; bounds memory for hubs.
+BATCH_SIZE = 512
+
+def similar_venues(venue_id):
+  neighbours = db.session.query(Venue.id, Venue.name, Venue.image_link)\
+    .join(Similarity, Similarity.neighbour_id == Venue.id)\
+    .filter(Similarity.kind == 'venue', Similarity.entity_id == venue_id)\
+    .order_by(Similarity.rank).all()
+  return [{'id': id, 'name': name, 'image_link': image_link} for id, name, image_link in neighbours]
+
+def similar_artists(artist_id):
+  neighbours = db.session.query(Artist.id, Artist.name, Artist.image_link)\
+    .join(Similarity, Similarity.neighbour_id == Artist.id)\
+    .filter(Similarity.kind == 'artist', Similarity.entity_id == artist_id)\
+    .order_by(Similarity.rank).all()
+  return [{'id': id, 'name': name, 'image_link': image_link} for id, name, image_link in neighbours]
+
+def forget(kind, entity_id):
+  # Call before deleting a venue or artist, in the same transaction. Its
+  # shows go with it, so queue it and everyone it booked (or was booked by)
+  # for the next rebuild; see SimilarityStale.
+  own, other, other_kind = (Shows.venue_id, Shows.artist_id, 'artist') if kind == 'venue' \
+    else (Shows.artist_id, Shows.venue_id, 'venue')
+  db.session.merge(SimilarityStale(kind=kind, entity_id=entity_id))
+  for (other_id,) in db.session.query(other).filter(own == entity_id).distinct():
+    db.session.merge(SimilarityStale(kind=other_kind, entity_id=other_id))
+
+def rebuild(full=False, top_k=TOP_K):
+  # Recompute neighbours for every entity whose similarities can have
+  # changed since the last build. A new (venue, artist) show changes that
+  # venue's row, hence its score against every venue sharing an artist with
+  # it: the affected set is everything two hops away in the booking graph.
+  # Deletions queued by forget() are seeds too; an entity that is gone has
+  # its rows dropped and everyone listing it as a neighbour recomputed.
+  import numpy as np
+  from scipy import sparse
+
+  state = SimilarityBuild.query.get(1) or SimilarityBuild(id=1, last_show_id=0)
+  since = 0 if full else state.last_show_id
+  latest = db.session.query(db.func.max(Shows.id)).scalar() or 0
+  queued = {'venue': set(), 'artist': set()}
+  for kind, entity_id in db.session.query(SimilarityStale.kind, SimilarityStale.entity_id):
+    queued[kind].add(entity_id)
+  if not full and latest <= since and not any(queued.values()):
+    return {'venue': 0, 'artist': 0}
+
+  changed = db.session.query(Shows.venue_id, Shows.artist_id)\
+    .filter(Shows.id > since, Shows.id <= latest).distinct().all()
+  pairs = db.session.query(ShowRollup.venue_id, ShowRollup.artist_id, db.func.sum(ShowRollup.show_count))\
+    .group_by(ShowRollup.venue_id, ShowRollup.artist_id).all()
+
+  updated = {'venue': ([], []), 'artist': ([], [])}
+  if pairs:
+    venue_ids, rows = np.unique(np.array([pair[0] for pair in pairs]), return_inverse=True)
+    artist_ids, cols = np.unique(np.array([pair[1] for pair in pairs]), return_inverse=True)
+    weights = np.log1p(np.array([pair[2] for pair in pairs], dtype=float))
+    bookings = sparse.csr_matrix((weights, (rows, cols)), shape=(len(venue_ids), len(artist_ids)))
+
+    for kind, matrix, ids, seeds in (
+        ('venue', bookings, venue_ids, [pair[0] for pair in changed]),
+        ('artist', bookings.T.tocsr(), artist_ids, [pair[1] for pair in changed])):
+      if full:
+        touched = np.arange(len(ids))
+      else:
+        gone = queued[kind].difference(ids.tolist())
+        seeds = seeds + list(queued[kind]) + _listing(kind, gone)
+        touched = _two_hops(matrix, _positions(ids, seeds))
+      updated[kind] = (ids[touched].tolist(), _neighbours(kind, matrix, ids, touched, top_k))
+
+  try:
+    for kind, (touched, neighbours) in updated.items():
+      stale = Similarity.query.filter(Similarity.kind == kind)
+      if not full:
+        stale = stale.filter(Similarity.entity_id.in_(sorted(set(touched) | queued[kind])))
+      stale.delete(synchronize_session=False)
+      db.session.bulk_insert_mappings(Similarity, neighbours)
+      SimilarityStale.query.filter(SimilarityStale.kind == kind, SimilarityStale.entity_id.in_(sorted(queued[kind])))\
+        .delete(synchronize_session=False)
+    state.last_show_id = latest
+    state.built_at = datetime.utcnow()
+    db.session.add(state)
+    db.session.commit()
+  except:
+    db.session.rollback()
+    raise
+  finally:
+    db.session.close()
+  return {kind: len(touched) for kind, (touched, neighbours) in updated.items()}
+
+def _listing(kind, gone):
+  # entities that list one of `gone` among their neighbours
+  if not gone:
+    return []
+  return [entity_id for (entity_id,) in db.session.query(Similarity.entity_id)
+          .filter(Similarity.kind == kind, Similarity.neighbour_id.in_(gone)).distinct()]
+
+def _positions(ids, wanted):
+  import numpy as np
+
+  return np.flatnonzero(np.isin(ids, wanted))
+
+def _two_hops(matrix, seeds):
+  import numpy as np
+  from scipy import sparse
+
+  if not len(seeds):
+    return seeds
+  indicator = sparse.csr_matrix(
+    (np.ones(len(seeds)), (np.zeros(len(seeds), dtype=int), seeds)), shape=(1, matrix.shape[0]))
+  reach = (indicator @ matrix) @ matrix.T
+  return np.union1d(seeds, reach.tocsr().indices)
+
+def _neighbours(kind, matrix, ids, touched, top_k):
+  import numpy as np
+  from scipy import sparse
+
+  norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+  norms[norms == 0] = 1
+  normalized = sparse.diags(1 / norms) @ matrix
+  transposed = normalized.T.tocsc()
+
+  neighbours = []
+  for start in range(0, len(touched), BATCH_SIZE):
+    batch = touched[start:start + BATCH_SIZE]
+    scores = (normalized[batch] @ transposed).tocsr()
+    for i, row in enumerate(batch):
+      cols = scores.indices[scores.indptr[i]:scores.indptr[i + 1]]
+      values = scores.data[scores.indptr[i]:scores.indptr[i + 1]]
+      keep = (cols != row) & (values > 0)
+      cols, values = cols[keep], values[keep]
+      if len(values) > top_k:
+        best = np.argpartition(-values, top_k)[:top_k]
+        cols, values = cols[best], values[best]
+      # highest score first, lower id breaks ties so rebuilds are stable
+      for rank, j in enumerate(np.lexsort((ids[cols], -values)), 1):
+        neighbours.append({
+          'kind': kind,
+          'entity_id': int(ids[row]),
+          'rank': rank,
+          'neighbour_id': int(ids[cols[j]]),
+          'score': round(float(values[j]), 6),
+        })
+  return neighbours
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+recommendations_cli = AppGroup('recommendations', help='Maintain similar venue/artist lists.')
+
+@recommendations_cli.command('rebuild')
+@click.option('--full', is_flag=True, help='Recompute every entity instead of only those touched by new shows.')
+@click.option('--top-k', default=TOP_K, show_default=True, help='Neighbours kept per venue/artist.')
+def rebuild_command(full, top_k):
+  """Fold new shows into the Similarity table."""
+  counts = rebuild(full=full, top_k=top_k)
+  click.echo('Updated neighbours for %(venue)d venues and %(artist)d artists.' % counts)
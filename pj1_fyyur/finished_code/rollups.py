@@ -0,0 +1,139 @@
+#----------------------------------------------------------------------------#
+# Show rollups.
+#
+# ShowRollup keeps one row per (venue, artist, month). record_show() bumps
+# the matching row in the same transaction that inserts a show, and the
+# dashboard helpers below only ever read rollup rows, never Shows.
+#----------------------------------------------------------------------------#
+
+import calendar
+import click
+from datetime import date
+from flask.cli import AppGroup
+from sqlalchemy import text
+from models import db, ShowRollup
+
+UPSERT_ROLLUP = text('''
+  INSERT INTO "ShowRollup" (venue_id, artist_id, month, show_count, weekday_counts)
+  VALUES (:venue_id, :artist_id, :month, 1, :weekday_counts)
+  ON CONFLICT (venue_id, artist_id, month) DO UPDATE
+  SET show_count = "ShowRollup".show_count + 1,
+      weekday_counts[:weekday] = "ShowRollup".weekday_counts[:weekday] + 1
+''')
+
+BACKFILL_ROLLUPS = text('''
+  INSERT INTO "ShowRollup" (venue_id, artist_id, month, show_count, weekday_counts)
+  SELECT venue_id, artist_id, date_trunc('month', start_time)::date, count(*),
+         ARRAY[''' + ', '.join(
+             "count(*) FILTER (WHERE extract(isodow FROM start_time) = %d)" % day
+             for day in range(1, 8)) + ''']
+  FROM "Shows"
+  GROUP BY 1, 2, 3
+''')
+
+GENRE_MIX = {
+  'venue': text('''
+    SELECT genre, sum(r.show_count)
+    FROM "ShowRollup" r JOIN "Artist" a ON a.id = r.artist_id, unnest(a.genres) AS genre
+    WHERE r.venue_id = :id
+    GROUP BY genre
+  '''),
+  'artist': text('''
+    SELECT genre, sum(r.show_count)
+    FROM "ShowRollup" r JOIN "Venue" v ON v.id = r.venue_id, unnest(v.genres) AS genre
+    WHERE r.artist_id = :id
+    GROUP BY genre
+  '''),
+}
+
+def record_show(show):
+  # Call after adding the show to the session and before committing, so the
+  # show and its rollup land in the same transaction.
+  weekday = show.start_time.isoweekday()
+  weekday_counts = [0] * 7
+  weekday_counts[weekday - 1] = 1
+  db.session.execute(UPSERT_ROLLUP, {
+    'venue_id': int(show.venue_id),
+    'artist_id': int(show.artist_id),
+    'month': show.start_time.date().replace(day=1),
+    'weekday_counts': weekday_counts,
+    'weekday': weekday,
+  })
+
+def backfill():
+  # Rebuild every rollup row from Shows in a single transaction.
+  try:
+    db.session.query(ShowRollup).delete()
+    db.session.execute(BACKFILL_ROLLUPS)
+    db.session.commit()
+  except:
+    db.session.rollback()
+    raise
+  finally:
+    db.session.close()
+  return ShowRollup.query.count()
+
+def venue_stats(venue_id):
+  rows = db.session.query(ShowRollup.month, ShowRollup.show_count, ShowRollup.weekday_counts)\
+    .filter(ShowRollup.venue_id == venue_id).all()
+  return summarize(rows, db.session.execute(GENRE_MIX['venue'], {'id': venue_id}).fetchall())
+
+def artist_stats(artist_id):
+  rows = db.session.query(ShowRollup.month, ShowRollup.show_count, ShowRollup.weekday_counts)\
+    .filter(ShowRollup.artist_id == artist_id).all()
+  return summarize(rows, db.session.execute(GENRE_MIX['artist'], {'id': artist_id}).fetchall())
+
+def summarize(rows, genres):
+  import numpy as np
+
+  data = {
+    'total_shows': 0,
+    'shows_per_month': [],
+    'busiest_weekdays': [],
+    'genre_mix': {},
+    'monthly_percentiles': {},
+    'monthly_trend': 0.0,
+  }
+  if not rows:
+    return data
+
+  # Month index (year * 12 + month) lets consecutive months be counted with
+  # bincount; months without shows fall out as zeros.
+  months = np.array([row[0].year * 12 + row[0].month - 1 for row in rows])
+  counts = np.array([row[1] for row in rows])
+  first = months.min()
+  per_month = np.bincount(months - first, weights=counts).astype(int)
+  weekdays = np.array([row[2] for row in rows]).sum(axis=0)
+
+  data['total_shows'] = int(per_month.sum())
+  data['shows_per_month'] = [{
+    'month': date((first + offset) // 12, (first + offset) % 12 + 1, 1).strftime('%Y-%m'),
+    'shows': int(shows),
+  } for offset, shows in enumerate(per_month)]
+  data['busiest_weekdays'] = [{
+    'weekday': calendar.day_name[int(day)],
+    'shows': int(weekdays[day]),
+  } for day in np.argsort(-weekdays, kind='stable') if weekdays[day]]
+  p50, p90, p99 = np.percentile(per_month, [50, 90, 99])
+  data['monthly_percentiles'] = {'p50': float(p50), 'p90': float(p90), 'p99': float(p99)}
+  if len(per_month) > 1:
+    data['monthly_trend'] = round(float(np.polyfit(np.arange(len(per_month)), per_month, 1)[0]), 3)
+
+  if genres:
+    weights = np.array([row[1] for row in genres], dtype=float)
+    shares = weights / weights.sum()
+    data['genre_mix'] = {
+      genres[i][0]: round(float(shares[i]), 3) for i in np.argsort(-shares, kind='stable')
+    }
+  return data
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+rollups_cli = AppGroup('rollups', help='Maintain the show rollup table.')
+
+@rollups_cli.command('backfill')
+def backfill_command():
+  """Rebuild ShowRollup from every existing show."""
+  click.echo('Rebuilt %d rollup rows.' % backfill())
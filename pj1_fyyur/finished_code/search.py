@@ -0,0 +1,110 @@
+#----------------------------------------------------------------------------#
+# Unified search.
+#
+# Venues, artists and shows are matched and ranked in one UNION ALL query.
+# Every branch is scored by score() so ranks are comparable, and a window
+# function pages each group inside the database. page_id is the venue or
+# artist page a result links to (a show links to its venue).
+#----------------------------------------------------------------------------#
+
+from datetime import datetime
+from sqlalchemy import String, case, cast, func, literal, or_, select, union_all
+from models import db, Venue, Artist, Shows
+
+PER_PAGE = 10
+KINDS = ('venue', 'artist', 'show')
+
+def _escape(term):
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def score(term, names, city, state, upcoming):
+  # name: exact 3, prefix 2, substring 1 (best of `names`)
+  # place: 1 when the term is the city, the state or "City, ST"
+  # activity: up to 1 for upcoming shows (saturates at 10)
+  escaped = _escape(term)
+  name_scores = [case(
+    (func.lower(name) == term.lower(), 3.0),
+    (name.ilike(escaped + '%', escape='\\'), 2.0),
+    (name.ilike('%' + escaped + '%', escape='\\'), 1.0),
+    else_=0.0) for name in names]
+  name_score = name_scores[0] if len(name_scores) == 1 else func.greatest(*name_scores)
+  place_score = case((place_match(term, city, state), 1.0), else_=0.0)
+  activity_score = func.least(upcoming, 10) / 10.0
+  return name_score + place_score + activity_score
+
+def place_match(term, city, state):
+  escaped = _escape(term)
+  return or_(
+    city.ilike(escaped, escape='\\'),
+    state.ilike(escaped, escape='\\'),
+    (city + ', ' + state).ilike(escaped + '%', escape='\\'),
+  )
+
+def search(term, page=1, per_page=PER_PAGE):
+  now = datetime.now()
+  contains = '%' + _escape(term) + '%'
+
+  venue_upcoming = select(func.count(Shows.id))\
+    .where(Shows.venue_id == Venue.id, Shows.start_time > now).scalar_subquery()
+  artist_upcoming = select(func.count(Shows.id))\
+    .where(Shows.artist_id == Artist.id, Shows.start_time > now).scalar_subquery()
+  show_upcoming = case((Shows.start_time > now, 1), else_=0)
+
+  venues = select(
+    literal('venue').label('kind'), Venue.id.label('id'), Venue.id.label('page_id'), Venue.name.label('title'),
+    (Venue.city + ', ' + Venue.state).label('detail'), Venue.image_link.label('image_link'),
+    venue_upcoming.label('upcoming'),
+    score(term, [Venue.name], Venue.city, Venue.state, venue_upcoming).label('score'),
+  ).where(or_(Venue.name.ilike(contains, escape='\\'), place_match(term, Venue.city, Venue.state)))
+
+  artists = select(
+    literal('artist').label('kind'), Artist.id.label('id'), Artist.id.label('page_id'), Artist.name.label('title'),
+    (Artist.city + ', ' + Artist.state).label('detail'), Artist.image_link.label('image_link'),
+    artist_upcoming.label('upcoming'),
+    score(term, [Artist.name], Artist.city, Artist.state, artist_upcoming).label('score'),
+  ).where(or_(Artist.name.ilike(contains, escape='\\'), place_match(term, Artist.city, Artist.state)))
+
+  shows = select(
+    literal('show').label('kind'), Shows.id.label('id'), Shows.venue_id.label('page_id'),
+    (Artist.name + ' at ' + Venue.name).label('title'),
+    cast(Shows.start_time, String).label('detail'), Artist.image_link.label('image_link'),
+    show_upcoming.label('upcoming'),
+    score(term, [Artist.name, Venue.name], Venue.city, Venue.state, show_upcoming).label('score'),
+  ).select_from(Shows).join(Venue, Venue.id == Shows.venue_id).join(Artist, Artist.id == Shows.artist_id)\
+    .where(or_(Artist.name.ilike(contains, escape='\\'), Venue.name.ilike(contains, escape='\\')))
+
+  matches = union_all(venues, artists, shows).subquery()
+  ranked = select(
+    matches,
+    func.row_number().over(partition_by=matches.c.kind,
+                           order_by=(matches.c.score.desc(), matches.c.id)).label('position'),
+    func.count().over(partition_by=matches.c.kind).label('total'),
+  ).subquery()
+  first, last = (page - 1) * per_page, page * per_page
+  # position 1 is always returned so every group reports its total
+  rows = db.session.execute(
+    select(ranked)
+      .where(or_(ranked.c.position == 1, ranked.c.position.between(first + 1, last)))
+      .order_by(ranked.c.kind, ranked.c.position)
+  ).fetchall()
+
+  results = {kind: {'count': 0, 'data': []} for kind in KINDS}
+  for row in rows:
+    group = results[row.kind]
+    group['count'] = row.total
+    if first < row.position <= last:
+      group['data'].append({
+        'id': row.id,
+        'page_id': row.page_id,
+        'name': row.title,
+        'detail': row.detail,
+        'image_link': row.image_link,
+        'upcoming_shows': row.upcoming,
+        'score': round(float(row.score), 3),
+      })
+  return {
+    'count': sum(group['count'] for group in results.values()),
+    'page': page,
+    'per_page': per_page,
+    'groups': results,
+  }
@@ -0,0 +1,56 @@
+#----------------------------------------------------------------------------#
+# Template compilation.
+#
+# Compiled templates are written to a FileSystemBytecodeCache shared by all
+# workers, and warm_templates() loads every template up front (preload() and
+# `flask templates compile` use it), so no request pays for compiling.
+# Compile and render times are recorded in metrics as template.compile:<name>
+# and template.render:<name>.
+#----------------------------------------------------------------------------#
+
+import click
+import os
+import time
+from flask import current_app
+from flask.cli import AppGroup
+from flask.templating import Environment
+from jinja2 import FileSystemBytecodeCache, Template
+from metrics import metrics
+
+class TimedTemplate(Template):
+
+  def render(self, *args, **kwargs):
+    with metrics.timer('template.render:%s' % self.name):
+      return super().render(*args, **kwargs)
+
+class TimedEnvironment(Environment):
+  # Only called when the bytecode cache has no entry for a template.
+  template_class = TimedTemplate
+
+  def compile(self, source, name=None, filename=None, raw=False, defer_init=False):
+    with metrics.timer('template.compile:%s' % name):
+      return super().compile(source, name, filename, raw, defer_init)
+
+def init_templates(app):
+  # Call before anything touches app.jinja_env.
+  app.jinja_environment = TimedEnvironment
+  cache_dir = app.config.get('TEMPLATE_CACHE_DIR')
+  if cache_dir:
+    os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(cache_dir))
+
+def warm_templates(app):
+  names = app.jinja_env.list_templates(extensions=['html'])
+  for name in names:
+    app.jinja_env.get_template(name)
+  return names
+
+templates_cli = AppGroup('templates', help='Precompile Jinja templates.')
+
+@templates_cli.command('compile')
+def compile_command():
+  """Compile every template into TEMPLATE_CACHE_DIR (run at build time)."""
+  started = time.perf_counter()
+  names = warm_templates(current_app)
+  click.echo('Compiled %d templates into %s in %.0f ms.' % (
+    len(names), current_app.config.get('TEMPLATE_CACHE_DIR'), (time.perf_counter() - started) * 1000))
@@ -0,0 +1,13 @@
+#----------------------------------------------------------------------------#
+# WSGI entry point for prefork servers.
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# The application is built once here, in the master process, and shared
+# copy-on-write with every forked worker (see gunicorn.conf.py).
+#----------------------------------------------------------------------------#
+
+from app import create_app, preload
+
+app = create_app()
+preload(app)
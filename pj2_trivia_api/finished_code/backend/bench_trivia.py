@@ -0,0 +1,484 @@
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from sqlalchemy import create_engine, event, text
+
+'''
+Trivia scale benchmark
+
+    python bench_trivia.py generate --questions 1000000 --categories 24
+    python bench_trivia.py run --requests 500 > after.json
+    python bench_trivia.py compare before.json after.json
+    python bench_trivia.py load --threads 16 --seconds 30
+    python bench_trivia.py encode --page-sizes 10 100
+
+generate fills a benchmark database (trivia_bench by default, see
+--database-url) with a synthetic question bank: it creates the tables,
+applies migrations/*.sql and COPYs the categories and questions in. The
+number of questions per category is skewed (Zipf, --skew), so there are
+both huge and tiny categories. Anything already in the database is
+replaced.
+
+run drives GET /questions, POST /questions/search,
+GET /categories/<id>/questions and POST /quizzes through the Flask test
+client. Each scenario runs in its own process and reports latency
+percentiles, SQL statements per request and peak RSS as JSON.
+
+compare prints the p95 latency and statement changes between two runs.
+
+load plays quiz sessions from --threads client threads for --seconds,
+reporting each answer for one of --players players, and prints the answer
+throughput and latency and how many database writes the answers cost
+(scores and answer statistics are written behind in batches).
+
+encode times building the body of a page of questions the old way
+(format() and jsonify) against splicing cached JSON fragments, with the
+fragment cache cold and warm.
+'''
+
+SCENARIOS = ('questions', 'search', 'category_questions', 'quizzes')
+SYLLABLES = ('ka', 'lo', 'mi', 'ren', 'tas', 'vo', 'bel', 'dun', 'sha', 'tor',
+             'ze', 'qui', 'mar', 'pol', 'nes', 'fi', 'gar', 'hu', 'jin', 'wex')
+
+
+def default_database_url():
+    from config import database_setup
+    return 'postgresql://{}:{}@{}/{}'.format(
+        database_setup['user_name'], database_setup['password'],
+        database_setup['port'], 'trivia_bench')
+
+
+def vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES)
+                          for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+'''
+generate
+'''
+
+
+class CopyStream:
+    # File-like object for COPY FROM STDIN that produces its lines lazily,
+    # so a million rows never sit in memory at once.
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = b''
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            line = line.encode('utf-8')
+            chunks.append(line)
+            length += len(line)
+        data = b''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def question_lines(count, category_ids, skew, words, rng):
+    weights = [1 / (rank + 1) ** skew for rank in range(len(category_ids))]
+    for _ in range(count):
+        category = rng.choices(category_ids, weights)[0]
+        question = ' '.join(rng.sample(words, rng.randint(5, 10)))
+        answer = ' '.join(rng.sample(words, rng.randint(1, 3)))
+        yield '{}?\t{}\t{}\t{}\n'.format(question.capitalize(), answer,
+                                         category, rng.randint(1, 5))
+
+
+def generate(args):
+    from models import db
+
+    if urlsplit(args.database_url).path.lstrip('/') in ('trivia',
+                                                        'trivia_test'):
+        raise SystemExit('refusing to replace the trivia or trivia_test '
+                         'database; create a separate one for benchmarks')
+    rng = random.Random(args.seed)
+    words = vocabulary(args.vocabulary, rng)
+    engine = create_engine(args.database_url)
+    db.metadata.create_all(engine)
+
+    connection = engine.raw_connection()
+    try:
+        connection.autocommit = True
+        cursor = connection.cursor()
+        migrations = os.path.join(os.path.dirname(__file__), 'migrations')
+        for name in sorted(os.listdir(migrations)):
+            if name.endswith('.sql'):
+                with open(os.path.join(migrations, name)) as migration:
+                    cursor.execute(migration.read())
+        cursor.execute(
+            'TRUNCATE questions, categories RESTART IDENTITY CASCADE')
+
+        started = time.perf_counter()
+        category_ids = list(range(1, args.categories + 1))
+        cursor.copy_expert(
+            'COPY categories (id, type) FROM STDIN',
+            CopyStream('{}\tCategory {}\n'.format(i, i)
+                       for i in category_ids))
+        cursor.execute("SELECT setval(pg_get_serial_sequence("
+                       "'categories', 'id'), %s)", (args.categories,))
+        cursor.copy_expert(
+            'COPY questions (question, answer, category, difficulty) '
+            'FROM STDIN',
+            CopyStream(question_lines(args.questions, category_ids,
+                                      args.skew, words, rng)))
+        cursor.execute('ANALYZE categories')
+        cursor.execute('ANALYZE questions')
+        elapsed = time.perf_counter() - started
+
+        cursor.execute('SELECT id, question_count FROM categories '
+                       'ORDER BY question_count DESC')
+        counts = cursor.fetchall()
+    finally:
+        connection.close()
+
+    print(json.dumps({
+        'database': urlsplit(args.database_url).path.lstrip('/'),
+        'questions': args.questions,
+        'categories': args.categories,
+        'skew': args.skew,
+        'seed': args.seed,
+        'load_seconds': round(elapsed, 1),
+        'largest_category': counts[0][1] if counts else 0,
+        'smallest_category': counts[-1][1] if counts else 0,
+    }, indent=2))
+
+
+'''
+run
+'''
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def scenario_requests(name, rng, words, categories, total, max_id):
+    # (method, path, json body) for one request of the scenario
+    pages = max(total // 10, 1)
+    if name == 'questions':
+        return 'GET', '/questions?page={}'.format(rng.randint(1, pages)), None
+    if name == 'search':
+        return 'POST', '/questions/search', {
+            'searchTerm': ' '.join(rng.sample(words, rng.randint(1, 2)))}
+    category = rng.choice(categories)
+    if name == 'category_questions':
+        return 'GET', '/categories/{}/questions'.format(category), None
+    return 'POST', '/quizzes', {
+        'previous_questions': rng.sample(range(1, max_id + 1),
+                                         min(20, max_id)),
+        'quiz_category': {'id': category},
+    }
+
+
+def run_scenario(name, database_url, requests, warmup, seed, vocabulary_size):
+    from flaskr import create_app
+    from models import db
+
+    rss_before_app = peak_rss_mb()
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url,
+                      'SQLALCHEMY_ECHO': False})
+    client = app.test_client()
+    counter = {'statements': 0}
+    with app.app_context():
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count(*args):
+            counter['statements'] += 1
+
+        categories = [row[0] for row in db.session.execute(text(
+            'SELECT id FROM categories WHERE question_count > 0'))]
+        total, max_id = db.session.execute(text(
+            'SELECT count(*), coalesce(max(id), 0) FROM questions')).first()
+    rng = random.Random(seed)
+    words = vocabulary(vocabulary_size, random.Random(seed))
+
+    timings, statements, errors = [], [], 0
+    for i in range(warmup + requests):
+        method, path, body = scenario_requests(
+            name, rng, words, categories, total, max_id)
+        counter['statements'] = 0
+        started = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        elapsed = (time.perf_counter() - started) * 1000
+        if i < warmup:
+            continue
+        if response.status_code >= 500:
+            errors += 1
+        timings.append(elapsed)
+        statements.append(counter['statements'])
+
+    timings.sort()
+
+    def percentile(p):
+        return round(timings[min(len(timings) - 1, int(len(timings) * p))], 2)
+
+    return {
+        'requests': requests,
+        'errors': errors,
+        'mean_ms': round(statistics.mean(timings), 2),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': round(timings[-1], 2),
+        'statements_mean': round(statistics.mean(statements), 2),
+        'statements_max': max(statements),
+        'rss_before_app_mb': rss_before_app,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run(args):
+    results = {}
+    for name in args.scenarios:
+        # a fresh process per scenario, so peak RSS is the scenario's own
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results[name] = executor.submit(
+                run_scenario, name, args.database_url, args.requests,
+                args.warmup, args.seed, args.vocabulary).result()
+    report = {
+        'database': urlsplit(args.database_url).path.lstrip('/'),
+        'requests': args.requests,
+        'warmup': args.warmup,
+        'seed': args.seed,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+'''
+load
+'''
+
+
+def load(args):
+    from flaskr import create_app
+    from flaskr.leaderboard import leaderboard
+    from flaskr.stats import answer_stats
+    from models import db
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database_url,
+                      'SQLALCHEMY_ECHO': False})
+    counter = {'statements': 0, 'writes': 0}
+    with app.app_context():
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count(connection, cursor, statement, *args):
+            counter['statements'] += 1
+            if 'INSERT INTO scores' in statement or \
+                    'INSERT INTO question_stats' in statement:
+                counter['writes'] += 1
+
+    deadline = time.perf_counter() + args.seconds
+
+    def play(number):
+        client = app.test_client()
+        rng = random.Random(args.seed + number)
+        latencies = []
+        while time.perf_counter() < deadline:
+            session_id = client.post('/quizzes/sessions',
+                                     json={}).get_json()['session_id']
+            for _ in range(10):
+                question = client.post(
+                    '/quizzes/sessions/{}/next'.format(session_id)).get_json()
+                if not question['success']:
+                    break
+                started = time.perf_counter()
+                response = client.post(
+                    '/quizzes/sessions/{}/answer'.format(session_id), json={
+                        'correct': rng.random() < 0.6,
+                        'player': 'player-{}'.format(
+                            rng.randrange(args.players)),
+                    })
+                latencies.append((time.perf_counter() - started) * 1000)
+                assert response.status_code == 200, response.status_code
+            client.delete('/quizzes/sessions/{}'.format(session_id))
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        latencies = sorted(latency for result in executor.map(
+            play, range(args.threads)) for latency in result)
+    elapsed = time.perf_counter() - started
+    # write what is still buffered, as the workers would on exit
+    leaderboard.buffer.flush()
+    answer_stats.flush()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1,
+                                   int(len(latencies) * p))], 2)
+
+    answers = len(latencies)
+    print(json.dumps({
+        'database': urlsplit(args.database_url).path.lstrip('/'),
+        'threads': args.threads,
+        'players': args.players,
+        'seconds': round(elapsed, 1),
+        'answers': answers,
+        'answers_per_second': round(answers / elapsed, 1),
+        'answer_p50_ms': percentile(0.50) if answers else None,
+        'answer_p95_ms': percentile(0.95) if answers else None,
+        'answer_p99_ms': percentile(0.99) if answers else None,
+        'statements': counter['statements'],
+        'batched_writes': counter['writes'],
+        'answers_per_write': round(answers / max(counter['writes'], 1), 1),
+    }, indent=2))
+
+
+'''
+encode
+'''
+
+
+def encode(args):
+    from flask import jsonify
+    from flaskr import create_app
+    from flaskr.fragments import array, fragments, json_response
+    from models import Category, Question
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database_url,
+                      'SQLALCHEMY_ECHO': False})
+
+    def timed(build, rows, envelope, before=None):
+        timings = []
+        for _ in range(args.iterations):
+            if before is not None:
+                before()
+            started = time.perf_counter()
+            body = build(rows, envelope)
+            timings.append((time.perf_counter() - started) * 1e6)
+        timings.sort()
+        return {
+            'mean_us': round(statistics.mean(timings), 1),
+            'p95_us': round(timings[int(len(timings) * 0.95) - 1], 1),
+            'bytes': len(body),
+        }, body
+
+    def formatted(rows, envelope):
+        return jsonify(dict(envelope, questions=[
+            question.format() for question in rows])).get_data()
+
+    def spliced(rows, envelope):
+        return json_response(envelope, questions=array([
+            fragments.get(question) for question in rows])).get_data()
+
+    def clear():
+        for question in rows:
+            fragments.discard(question.id)
+
+    results = {}
+    with app.test_request_context():
+        categories = {category.id: category.type
+                      for category in Category.query.order_by(Category.id)}
+        for page_size in args.page_sizes:
+            rows = Question.query.order_by(Question.id).limit(page_size).all()
+            envelope = {
+                'success': True,
+                'total_questions': 1000000,
+                'next_after': rows[-1].id if rows else None,
+                'categories': categories,
+            }
+            old, old_body = timed(formatted, rows, envelope)
+            cold, _ = timed(spliced, rows, envelope, clear)
+            warm, new_body = timed(spliced, rows, envelope)
+            assert json.loads(old_body) == json.loads(new_body)
+            results[page_size] = {'format_jsonify': old,
+                                  'fragments_cold': cold,
+                                  'fragments_warm': warm}
+    print(json.dumps({'iterations': args.iterations, 'pages': results},
+                     indent=2))
+
+
+'''
+compare
+'''
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)['results']
+    with open(args.after) as f:
+        after = json.load(f)['results']
+    for name in SCENARIOS:
+        if name not in before or name not in after:
+            continue
+        old, new = before[name], after[name]
+        print('{:<20} p95 {:>9.2f} -> {:>9.2f} ms ({:+.0%})   '
+              'statements {:>6.2f} -> {:>6.2f}   rss {} -> {} MB'.format(
+                  name, old['p95_ms'], new['p95_ms'],
+                  new['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0,
+                  old['statements_mean'], new['statements_mean'],
+                  old['peak_rss_mb'], new['peak_rss_mb']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trivia scale benchmark.')
+    parser.add_argument('--database-url', default=None,
+                        help='benchmark database (default trivia_bench on '
+                             'the server in config.py)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--vocabulary', type=int, default=5000,
+                        help='distinct words in generated questions')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = commands.add_parser('generate')
+    generate_parser.add_argument('--questions', type=int, default=1000000)
+    generate_parser.add_argument('--categories', type=int, default=24)
+    generate_parser.add_argument('--skew', type=float, default=1.0,
+                                 help='Zipf exponent of category sizes')
+    generate_parser.set_defaults(handler=generate)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--requests', type=int, default=200)
+    run_parser.add_argument('--warmup', type=int, default=10)
+    run_parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS,
+                            default=list(SCENARIOS))
+    run_parser.add_argument('--output', help='also write the JSON here')
+    run_parser.set_defaults(handler=run)
+
+    load_parser = commands.add_parser('load')
+    load_parser.add_argument('--threads', type=int, default=8)
+    load_parser.add_argument('--seconds', type=float, default=30)
+    load_parser.add_argument('--players', type=int, default=1000)
+    load_parser.set_defaults(handler=load)
+
+    encode_parser = commands.add_parser('encode')
+    encode_parser.add_argument('--page-sizes', type=int, nargs='+',
+                               default=[10, 100])
+    encode_parser.add_argument('--iterations', type=int, default=2000)
+    encode_parser.set_defaults(handler=encode)
+
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    if args.database_url is None:
+        args.database_url = default_database_url()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,3 +12,41 @@ database_setup = {
     "password": "041393",  # if applicable. If no password, just type in None
     "port": "localhost:5432"  # default postgres port
 }
+
+# Quiz sessions (/quizzes/sessions): 'memory' keeps them in the process,
+# 'sql' in QUIZ_SESSION_DATABASE_URI (the trivia database when None).
+QUIZ_SESSION_STORE = 'memory'
+QUIZ_SESSION_DATABASE_URI = None
+# Seconds a session lives after its last question.
+QUIZ_SESSION_TTL = 3600
+
+# Quiz draws pick from in-memory question id pools; each worker rebuilds
+# them this often (seconds) to see other workers' changes.
+QUESTION_POOL_RESYNC = 60
+
+# New questions whose estimated similarity to an existing one reaches this
+# are refused as near-duplicates (see flaskr/dedup.py).
+DEDUP_THRESHOLD = 0.8
+
+# Answers reported in quiz sessions are counted in memory and written to
+# question_stats this often (seconds), or sooner once this many questions
+# have pending counts.
+ANSWER_STATS_FLUSH_INTERVAL = 5
+ANSWER_STATS_MAX_PENDING = 500
+
+# Quiz packs (/quizzes/packs): questions per pack, packs of each size per
+# category, and how long clients may cache a pack (seconds).
+QUIZ_PACK_SIZES = (10, 20)
+QUIZ_PACKS_PER_SIZE = 8
+QUIZ_PACK_MAX_AGE = 300
+
+# Leaderboard: players listed per category, seconds between reloads of
+# each worker's copy, and how often (seconds) or after how many pending
+# (player, category) pairs buffered scores are written.
+LEADERBOARD_SIZE = 10
+LEADERBOARD_REFRESH = 30
+SCORES_FLUSH_INTERVAL = 2
+SCORES_MAX_PENDING = 1000
+
+# Questions kept pre-encoded as JSON per worker.
+QUESTION_FRAGMENT_CACHE_SIZE = 10000
@@ -1,32 +1,85 @@
 from curses.ascii import NUL
 from genericpath import exists
+import gzip
 import os
-from flask import Flask, request, abort, jsonify
+from flask import (Flask, request, abort, jsonify, Response,
+                   stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
-
-from models import setup_db, Question, Category, db
+from sqlalchemy import func
+
+from models import setup_db, database_path, Question, db
+from .pools import pools
+from .search import search_questions as search
+from .categories import category_cache
+from .bulk import read_rows, import_questions, export_questions
+from .batch import all_applied, delete_questions, update_questions
+from .dedup import dedup_cli, find_duplicates, signature
+from .packs import packs_cli, get_pack, sizes, packs_per_size
+from .fragments import fragments, array, json_response
+from .sessions import init_session_store
+from .stats import answer_stats, record_answer
+from .leaderboard import leaderboard, player_name
 
 QUESTIONS_PER_PAGE = 10
 # Helper function to paginate questions
+# `selection` is a Question query; only the requested page is fetched and
+# returned as Question rows (see fragments.py to encode them).
+# ?page=N pages with LIMIT/OFFSET, ?after=<id> continues after the last
+# question id seen, which stays cheap however deep the page is.
 
 
 def get_paginated_questions(request, selection):
-    page = request.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
+    selection = selection.order_by(None).order_by(Question.id)
+    after = request.args.get('after', type=int)
+    if after is not None:
+        selection = selection.filter(Question.id > after)
+    else:
+        page = request.args.get('page', 1, type=int)
+        selection = selection.offset(max(page - 1, 0) * QUESTIONS_PER_PAGE)
+
+    return selection.limit(QUESTIONS_PER_PAGE).all()
+
+
+# Helper function to encode a page of questions for json_response()
+
+
+def encode_questions(current_questions):
+    return array([fragments.get(question) for question in current_questions])
+
+
+# Helper function to count a Question query with a single COUNT(*)
 
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
 
-    return current_questions
+def count_questions(selection):
+    return selection.order_by(None).with_entities(
+        func.count(Question.id)).scalar()
+
+
+# Cursor for ?after= when there may be another page, else None
+
+
+def next_cursor(current_questions):
+    if len(current_questions) < QUESTIONS_PER_PAGE:
+        return None
+    return current_questions[-1].id
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    app.config.from_object('config')
+    if test_config is not None:
+        app.config.update(test_config)
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path))
+    sessions = init_session_store(app, db)
+    pools.init_app(app)
+    fragments.init_app(app)
+    answer_stats.init_app(app, app.config.get('ANSWER_STATS_FLUSH_INTERVAL'),
+                          app.config.get('ANSWER_STATS_MAX_PENDING'))
+    leaderboard.init_app(app)
+    app.cli.add_command(dedup_cli)
+    app.cli.add_command(packs_cli)
 
     '''
   @DONE: Set up CORS. Allow '*' for origins.
@@ -44,20 +97,23 @@ def create_app(test_config=None):
         )
         response.headers.add(
             'Access-Control-Allow-Methods',
-            'GET, POST, PUT, DELETE'
+            'GET, POST, PUT, PATCH, DELETE'
         )
         return response
 
     @app.route('/categories', methods=['GET'])
     def get_categories():
-        categories = Category.query.all()
+        etag, categories, counts = category_cache.current()
         if len(categories) == 0:
             abort(404)
 
-        return jsonify({
+        response = jsonify({
             'success': True,
-            'categories': {category.id: category.type for category in categories}
+            'categories': categories,
+            'question_counts': counts,
         })
+        response.set_etag(etag)
+        return response.make_conditional(request)
 
     '''
   @DONE:
@@ -74,19 +130,17 @@ def create_app(test_config=None):
   '''
     @app.route('/questions', methods=['GET'])
     def get_questions():
-        selection = Question.query.order_by(Question.id).all()
+        selection = Question.query
         current_questions = get_paginated_questions(request, selection)
         if (len(current_questions) == 0):
             abort(404)
 
-        categories = Category.query.order_by(Category.type).all()
-
-        return jsonify({
+        return json_response({
             'success': True,
-            'questions': current_questions,
-            'total_questions': len(selection),
-            'categories': {category.id: category.type for category in categories},
-        })
+            'total_questions': count_questions(selection),
+            'next_after': next_cursor(current_questions),
+            'categories': category_cache.categories(),
+        }, questions=encode_questions(current_questions))
     '''
   @Done:
   Create an endpoint to DELETE question using a question ID.
@@ -105,6 +159,43 @@ def create_app(test_config=None):
             'deleted': question_id,
         })
 
+    '''
+  Batch delete and batch edit: each request is one statement in one
+  transaction, answered with an outcome per id.
+  '''
+    @app.route('/questions', methods=['DELETE'])
+    def batch_delete_questions():
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            abort(422)
+        try:
+            results = delete_questions(body.get('ids'))
+        except ValueError:
+            abort(422)
+
+        return jsonify({
+            'success': all_applied(results),
+            'deleted': sum(r['status'] == 'deleted' for r in results),
+            'results': results,
+        })
+
+    @app.route('/questions', methods=['PATCH'])
+    def batch_update_questions():
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            abort(422)
+        try:
+            results = update_questions(body.get('questions'),
+                                       category_cache.categories())
+        except ValueError:
+            abort(422)
+
+        return jsonify({
+            'success': all_applied(results),
+            'updated': sum(r['status'] == 'updated' for r in results),
+            'results': results,
+        })
+
     '''
   @DONE?:
   Create an endpoint to POST a new question,
@@ -122,22 +213,72 @@ def create_app(test_config=None):
         create_category = request.json.get('category')
         create_difficulty = request.json.get('difficulty')
 
+        # near-duplicates of an existing question are refused unless the
+        # client insists with allow_duplicate
+        if isinstance(create_question, str) and \
+                not request.json.get('allow_duplicate'):
+            duplicates = find_duplicates([signature(create_question)])[0]
+            if duplicates:
+                return jsonify({
+                    'success': False,
+                    'error': 409,
+                    'message': 'duplicate question',
+                    'duplicates': [{
+                        'id': question_id,
+                        'similarity': round(similarity, 2),
+                    } for question_id, similarity in duplicates],
+                }), 409
+
         try:
             new_question = Question(create_question, create_answer,
                                     create_category, create_difficulty)
             new_question.insert()
 
-            selection = Question.query.order_by(Question.id).all()
-            current_questions = get_paginated_questions(request, selection)
+            current_questions = get_paginated_questions(
+                request, Question.query)
 
-            return jsonify({
+            return json_response({
                 'success': True,
-                'questions': current_questions,
-            })
+                'created': new_question.id,
+            }, questions=encode_questions(current_questions))
 
         except Exception:
             abort(422)
     '''
+  Bulk import (NDJSON, or CSV with a header row, streamed in the request
+  body) and streaming export of all questions. Near-duplicate rows are
+  rejected unless ?allow_duplicates=true.
+  '''
+    @app.route('/questions/bulk', methods=['POST'])
+    def bulk_import_questions():
+        allow_duplicates = request.args.get('allow_duplicates') == 'true'
+        threshold = None if allow_duplicates else \
+            app.config.get('DEDUP_THRESHOLD', 0.8)
+        rows = read_rows(request.stream, request.mimetype)
+        report = import_questions(rows, category_cache.categories(),
+                                  threshold)
+
+        return jsonify({
+            'success': report['failed'] == 0,
+            'inserted': report['inserted'],
+            'failed': report['failed'],
+            'errors': report['errors'],
+        })
+
+    @app.route('/questions/export', methods=['GET'])
+    def export_all_questions():
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in ('ndjson', 'csv'):
+            abort(400)
+
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        return Response(stream_with_context(export_questions(fmt)),
+                        mimetype=mimetype, headers={
+                            'Content-Disposition':
+                                'attachment; filename=questions.' + fmt,
+                        })
+
+    '''
   @TODO?:
   Create a POST endpoint to get questions based on a search term.
   It should return any questions for whom the search term
@@ -148,22 +289,24 @@ def create_app(test_config=None):
   '''
     @app.route('/questions/search', methods=['POST'])
     def search_questions():
-        data = request.get_json()
-        search_term = data.get('searchTerm')
-        if search_term == ' ':
-            abort(404)
-
-        categories = Category.query.order_by(Category.type).all()
+        data = request.get_json(silent=True) or {}
+        search_term = data.get('searchTerm', data.get('search_term'))
+        if search_term is not None and not isinstance(search_term, str):
+            abort(422)
+        search_term = (search_term or '').strip()
 
-        selection = Question.query.filter(Question.question
-                                          .ilike(f'%{search_term}%')).order_by(Question.id).all()
-        paginated_questions = get_paginated_questions(request, selection)
+        if search_term:
+            page = request.args.get('page', 1, type=int)
+            found_questions, total = search(
+                search_term, page, QUESTIONS_PER_PAGE)
+        else:
+            found_questions, total = [], 0
 
         return jsonify({
             'success': True,
-            'questions': paginated_questions,
-            'total_questions': len(selection),
-            'categories': {category.id: category.type for category in categories},
+            'questions': found_questions,
+            'total_questions': total,
+            'categories': category_cache.categories(),
         })
 
     '''
@@ -177,17 +320,17 @@ def create_app(test_config=None):
     @app.route('/categories/<int:category_id>/questions')
     def get_questions_by_category(category_id):
         selection = Question.query.filter(
-            Question.category == category_id).all()
+            Question.category == category_id)
         current_questions = get_paginated_questions(request, selection)
         if len(current_questions) == 0:
             abort(404)
 
-        return jsonify({
+        return json_response({
             'success': True,
-            'questions': current_questions,
-            'total_questions': len(current_questions),
+            'total_questions': count_questions(selection),
+            'next_after': next_cursor(current_questions),
             'current_category': category_id,
-        })
+        }, questions=encode_questions(current_questions))
 
     '''
   @TODO:
@@ -203,36 +346,201 @@ def create_app(test_config=None):
     def play_quiz():
         try:
             data = request.get_json()
-            previous_qs = data.get('previous_questions')
+            previous_qs = [int(q_id)
+                           for q_id in data.get('previous_questions') or []]
             quiz_category = data.get('quiz_category')
-            c_id = quiz_category['id']
+            c_id = int(quiz_category['id']) if quiz_category else 0
+            difficulty = data.get('difficulty')
+            if difficulty is not None:
+                difficulty = int(difficulty)
+
+            question = pools.draw(c_id, set(previous_qs), difficulty)
+        except Exception:
+            abort(422)
+
+        if question is None:
+            return jsonify({
+                'success': False
+            })
 
-            if c_id == 0:
-                questions = Question.query.all()
+        return json_response({
+            'success': True,
+        }, question=question[1])
+    '''
+  Quiz sessions: the server remembers which questions a quiz has asked,
+  so each request only carries the session id. Adaptive sessions pick the
+  difficulty of each question from the answers reported so far.
+  '''
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        try:
+            data = request.get_json(silent=True) or {}
+            quiz_category = data.get('quiz_category')
+            c_id = int(quiz_category['id']) if quiz_category else 0
+            adaptive = bool(data.get('adaptive', False))
+        except Exception:
+            abort(422)
+        if not pools.count(c_id):
+            abort(422)
+
+        session = sessions.create(c_id, adaptive)
+        return jsonify({
+            'success': True,
+            'session_id': session.id,
+            'quiz_category': c_id,
+            'adaptive': adaptive,
+            'expires_in': sessions.ttl,
+        })
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def next_quiz_question(session_id):
+        session = sessions.get(session_id)
+        if session is None:
+            abort(404)
+
+        try:
+            if session.adaptive:
+                question = pools.draw_near(session.category, session.seen,
+                                           session.difficulty())
             else:
-                questions = Question.query.filter_by(category=c_id).all()
-
-            if questions:
-                listQuestion = []
-                for ques in questions:
-                    if ques.format()['id'] not in previous_qs:
-                        listQuestion.append(ques)
-                        print(listQuestion)
-
-                if listQuestion:
-                    question = listQuestion[random.randint(
-                        0, len(listQuestion)-1)]
-                    return jsonify({
-                        'success': True,
-                        'question': question.format()
-                    })
+                question = pools.draw(session.category, session.seen)
+        except LookupError:
+            abort(422)
 
-                return jsonify({
-                    'success': False
-                })
+        if question is None:
+            return jsonify({
+                'success': False,
+                'asked': len(session.seen),
+            })
+
+        question_id, fragment = question
+        session.seen.add(question_id)
+        session.current = question_id
+        sessions.save(session)
+        return json_response({
+            'success': True,
+            'asked': len(session.seen),
+        }, question=fragment)
 
-        except:
+    @app.route('/quizzes/sessions/<session_id>/answer', methods=['POST'])
+    def answer_quiz_question(session_id):
+        session = sessions.get(session_id)
+        if session is None:
+            abort(404)
+        data = request.get_json(silent=True) or {}
+        correct = data.get('correct')
+        player = player_name(data.get('player'))
+        if session.current is None or not isinstance(correct, bool) or \
+                (data.get('player') is not None and player is None):
             abort(422)
+
+        record_answer(session.current, correct)
+        if player is not None:
+            leaderboard.record(player, session.category, 1, int(correct))
+        session.answer(correct)
+        sessions.save(session)
+        return jsonify({
+            'success': True,
+            'answered': session.answered,
+            'correct': session.correct,
+            'accuracy': session.accuracy(),
+            'next_difficulty': session.difficulty()
+            if session.adaptive else None,
+        })
+
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def delete_quiz_session(session_id):
+        if not sessions.delete(session_id):
+            abort(404)
+        return jsonify({
+            'success': True,
+            'deleted': session_id,
+        })
+
+    '''
+  Quiz results count towards the leaderboard (top players overall and per
+  category), which is served from memory and written behind in batches.
+  '''
+    @app.route('/quizzes/results', methods=['POST'])
+    def record_quiz_result():
+        data = request.get_json(silent=True) or {}
+        player = player_name(data.get('player'))
+        try:
+            quiz_category = data.get('quiz_category')
+            c_id = int(quiz_category['id']) if quiz_category else 0
+            answered = int(data.get('answered'))
+            correct = int(data.get('correct'))
+        except Exception:
+            abort(422)
+        if player is None or not 0 <= correct <= answered <= 1000 or \
+                (c_id and c_id not in category_cache.categories()):
+            abort(422)
+
+        leaderboard.record(player, c_id, answered, correct)
+        return jsonify({
+            'success': True,
+            'player': player,
+        })
+
+    @app.route('/leaderboard', methods=['GET'])
+    def get_leaderboard():
+        c_id = request.args.get('category', 0, type=int)
+        if c_id and c_id not in category_cache.categories():
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'category': c_id,
+            'leaders': leaderboard.top(c_id),
+        })
+
+    '''
+  Quiz packs: whole quizzes of fixed sizes per category (0 for all),
+  precomputed as gzip-compressed JSON and served with strong ETags.
+  '''
+    @app.route('/quizzes/packs', methods=['GET'])
+    def list_quiz_packs():
+        categories = category_cache.categories()
+        packs = []
+        for c_id in [0] + sorted(categories):
+            count = pools.count(c_id)
+            if count:
+                packs.extend({
+                    'category': c_id,
+                    'size': size,
+                    'questions': min(size, count),
+                    'packs': packs_per_size(),
+                } for size in sizes())
+
+        return jsonify({
+            'success': True,
+            'packs': packs,
+            'url': '/quizzes/packs/{category}/{size}/{number}',
+        })
+
+    @app.route('/quizzes/packs/<int:category_id>/<int:size>/<int:number>',
+               methods=['GET'])
+    def get_quiz_pack(category_id, size, number):
+        pack = get_pack(category_id, size, number)
+        if pack is None:
+            abort(404)
+        etag, body = pack
+
+        if 'gzip' in request.accept_encodings:
+            response = Response(body, mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            # a different representation, so a different strong ETag
+            response = Response(gzip.decompress(body),
+                                mimetype='application/json')
+            etag += '-identity'
+        response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config.get(
+            'QUIZ_PACK_MAX_AGE', 300)
+        return response.make_conditional(request)
+
     '''
   @TODO:
   Create error handlers for all expected errors
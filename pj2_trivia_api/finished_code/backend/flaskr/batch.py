@@ -0,0 +1,186 @@
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import Integer, String
+
+from models import Question, db, notify_question_change
+
+'''
+Batch changes
+
+delete_questions() and update_questions() change any number of questions
+with one statement in one transaction and report an outcome per id:
+'deleted' or 'updated', 'not_found', 'conflict' (the question's version is
+not the one the client sent) or 'invalid' with an error. The question
+listeners are then told about all changed questions at once, so pools,
+packs and the near-duplicate index are updated with one batch each.
+'''
+
+MAX_BATCH_SIZE = 1000
+FIELDS = ('question', 'answer', 'category', 'difficulty')
+
+DELETE_QUESTIONS = text('''
+    DELETE FROM questions WHERE id = ANY(:ids)
+    RETURNING id, question, answer, category, difficulty, version
+''').bindparams(bindparam('ids', type_=ARRAY(Integer)))
+# NULL leaves a field as it is; a NULL version skips the version check
+UPDATE_QUESTIONS = text('''
+    UPDATE questions AS q
+    SET question = coalesce(c.question, q.question),
+        answer = coalesce(c.answer, q.answer),
+        category = coalesce(c.category, q.category),
+        difficulty = coalesce(c.difficulty, q.difficulty),
+        version = q.version + 1
+    FROM unnest(:ids, :questions, :answers, :categories, :difficulties,
+                :versions)
+           AS c (id, question, answer, category, difficulty, version)
+    WHERE q.id = c.id AND (c.version IS NULL OR q.version = c.version)
+    RETURNING q.id, q.question, q.answer, q.category, q.difficulty,
+              q.version
+''').bindparams(
+    bindparam('ids', type_=ARRAY(Integer)),
+    bindparam('questions', type_=ARRAY(String)),
+    bindparam('answers', type_=ARRAY(String)),
+    bindparam('categories', type_=ARRAY(Integer)),
+    bindparam('difficulties', type_=ARRAY(Integer)),
+    bindparam('versions', type_=ARRAY(Integer)),
+)
+EXISTING = text('SELECT id FROM questions WHERE id = ANY(:ids)').bindparams(
+    bindparam('ids', type_=ARRAY(Integer)))
+
+
+def _question(row):
+    # a detached Question for the listeners
+    question = Question(row.question, row.answer, row.category,
+                        row.difficulty)
+    question.id = row.id
+    question.version = row.version
+    return question
+
+
+def _id(value):
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError('id must be a positive integer')
+    return value
+
+
+def delete_questions(ids):
+    # [{'id': ..., 'status': ...}] in the order of ids; raises ValueError
+    # when ids is not a list of question ids
+    if not isinstance(ids, list) or not 0 < len(ids) <= MAX_BATCH_SIZE:
+        raise ValueError('ids must be a list of 1 to {} ids'.format(
+            MAX_BATCH_SIZE))
+    ids = [_id(question_id) for question_id in ids]
+    try:
+        rows = db.session.execute(DELETE_QUESTIONS,
+                                  {'ids': sorted(set(ids))}).fetchall()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    deleted = {row.id for row in rows}
+    if rows:
+        notify_question_change('delete', [_question(row) for row in rows])
+    return [{'id': question_id,
+             'status': 'deleted' if question_id in deleted else 'not_found'}
+            for question_id in ids]
+
+
+def all_applied(results):
+    # the success of a batch: no id was missing, conflicting or invalid
+    return all(result['status'] in ('deleted', 'updated')
+               for result in results)
+
+
+def validate_change(change, categories):
+    # (id, {field: value}, expected version or None); raises ValueError
+    if not isinstance(change, dict):
+        raise ValueError('expected a JSON object')
+    question_id = _id(change.get('id'))
+    unknown = set(change) - set(FIELDS) - {'id', 'version'}
+    if unknown:
+        raise ValueError('unknown fields: {}'.format(
+            ', '.join(sorted(unknown))))
+    values = {}
+    for field in ('question', 'answer'):
+        if field in change:
+            value = change[field]
+            if not isinstance(value, str) or not value.strip():
+                raise ValueError('{} can not be blank'.format(field))
+            values[field] = value.strip()
+    for field in ('category', 'difficulty'):
+        if field in change:
+            value = change[field]
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise ValueError('{} must be an integer'.format(field))
+            values[field] = value
+    if 'category' in values and values['category'] not in categories:
+        raise ValueError('unknown category {}'.format(values['category']))
+    if 'difficulty' in values and not 1 <= values['difficulty'] <= 5:
+        raise ValueError('difficulty must be between 1 and 5')
+    if not values:
+        raise ValueError('nothing to change')
+    version = change.get('version')
+    if version is not None and (isinstance(version, bool) or
+                                not isinstance(version, int)):
+        raise ValueError('version must be an integer')
+    return question_id, values, version
+
+
+def update_questions(changes, categories):
+    # [{'id': ..., 'status': ..., ...}] in the order of changes; raises
+    # ValueError when changes is not a list of changes
+    if not isinstance(changes, list) or \
+            not 0 < len(changes) <= MAX_BATCH_SIZE:
+        raise ValueError('questions must be a list of 1 to {} changes'.format(
+            MAX_BATCH_SIZE))
+    results, valid = [], {}
+    for change in changes:
+        question_id = change.get('id') if isinstance(change, dict) else None
+        try:
+            question_id, values, version = validate_change(change,
+                                                           categories)
+            if question_id in valid:
+                raise ValueError('id {} appears more than once'.format(
+                    question_id))
+        except ValueError as e:
+            results.append({'id': question_id, 'status': 'invalid',
+                            'error': str(e)})
+            continue
+        valid[question_id] = (values, version)
+        results.append({'id': question_id})
+
+    rows, existing = [], set()
+    if valid:
+        ids = sorted(valid)
+        try:
+            rows = db.session.execute(UPDATE_QUESTIONS, {
+                'ids': ids,
+                'versions': [valid[i][1] for i in ids],
+                'questions': [valid[i][0].get('question') for i in ids],
+                'answers': [valid[i][0].get('answer') for i in ids],
+                'categories': [valid[i][0].get('category') for i in ids],
+                'difficulties': [valid[i][0].get('difficulty') for i in ids],
+            }).fetchall()
+            updated = {row.id for row in rows}
+            missed = [i for i in ids if i not in updated]
+            if missed:
+                existing = set(db.session.execute(
+                    EXISTING, {'ids': missed}).scalars())
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    versions = {row.id: row.version for row in rows}
+    for result in results:
+        if 'status' in result:
+            continue
+        if result['id'] in versions:
+            result.update(status='updated', version=versions[result['id']])
+        else:
+            result['status'] = 'conflict' if result['id'] in existing \
+                else 'not_found'
+    if rows:
+        notify_question_change('update', [_question(row) for row in rows])
+    return results
@@ -0,0 +1,171 @@
+import csv
+import io
+import json
+
+from sqlalchemy import insert, select
+
+from models import Question, QuestionBucket, db, notify_question_change
+from .dedup import bucket_rows, buckets, find_duplicates, signature, \
+    similarity
+
+'''
+Bulk import and export
+
+import_questions() reads rows one at a time from an NDJSON or CSV stream,
+validates them and inserts the valid ones in chunks of BULK_CHUNK_SIZE,
+each chunk as one multi-row INSERT in its own transaction, so memory stays
+flat and a bad row only costs its own line in the report. Unless told
+otherwise, rows that nearly duplicate an existing question or an earlier
+row of the same import are rejected (see dedup.py): earlier chunks are
+already in question_lsh, so only the current chunk's rows are compared in
+memory.
+
+export_questions() streams every question from a server-side cursor,
+BULK_CHUNK_SIZE rows at a time.
+'''
+
+BULK_CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 100
+FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+
+def read_rows(stream, content_type):
+    # (line number, row dict or an error message) for each input row
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if content_type == 'text/csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, 'invalid JSON'
+            continue
+        yield line_number, row if isinstance(row, dict) \
+            else 'expected a JSON object'
+
+
+def validate_row(row, categories):
+    # The values to insert, or raises ValueError with what is wrong.
+    question = row.get('question')
+    answer = row.get('answer')
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError('question is required')
+    if not isinstance(answer, str) or not answer.strip():
+        raise ValueError('answer is required')
+    try:
+        category = int(row.get('category'))
+        difficulty = int(row.get('difficulty'))
+    except (TypeError, ValueError):
+        raise ValueError('category and difficulty must be integers')
+    if category not in categories:
+        raise ValueError('unknown category {}'.format(category))
+    if not 1 <= difficulty <= 5:
+        raise ValueError('difficulty must be between 1 and 5')
+    return {
+        'question': question.strip(),
+        'answer': answer.strip(),
+        'category': category,
+        'difficulty': difficulty,
+    }
+
+
+def import_questions(rows, categories, threshold=None,
+                     chunk_size=BULK_CHUNK_SIZE):
+    # threshold: similarity at which rows count as duplicates, None to
+    # accept duplicates
+    report = {'inserted': 0, 'failed': 0, 'errors': []}
+
+    def reject(line_number, error):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line_number, 'error': error})
+
+    def unique(chunk):
+        sigs = [signature(values['question']) for _, values in chunk]
+        if threshold is None:
+            return [entry + (sig,) for entry, sig in zip(chunk, sigs)]
+        # accepted rows of this chunk by bucket
+        imported, accepted = {}, []
+        for (line_number, values), sig, duplicates in zip(
+                chunk, sigs, find_duplicates(sigs, threshold)):
+            if duplicates:
+                reject(line_number, 'duplicate of question {}'.format(
+                    duplicates[0][0]))
+                continue
+            earlier = next((other_line for key in buckets(sig)
+                            for other_line, other in imported.get(key, ())
+                            if similarity(sig, other) >= threshold), None)
+            if earlier is not None:
+                reject(line_number, 'duplicate of line {}'.format(earlier))
+                continue
+            for key in buckets(sig):
+                imported.setdefault(key, []).append((line_number, sig))
+            accepted.append((line_number, values, sig))
+        return accepted
+
+    def flush(chunk):
+        accepted = unique(chunk)
+        if not accepted:
+            return
+        try:
+            ids = db.session.execute(
+                insert(Question.__table__)
+                .values([values for _, values, _ in accepted])
+                .returning(Question.id)).scalars().all()
+            db.session.execute(insert(QuestionBucket.__table__), [
+                row for question_id, (_, _, sig) in zip(ids, accepted)
+                for row in bucket_rows(question_id, sig)])
+            db.session.commit()
+            report['inserted'] += len(accepted)
+        except Exception as e:
+            db.session.rollback()
+            for line_number, _, _ in accepted:
+                reject(line_number, 'chunk not inserted: {}'.format(
+                    type(e).__name__))
+
+    chunk = []
+    for line_number, row in rows:
+        if isinstance(row, str):
+            reject(line_number, row)
+            continue
+        try:
+            chunk.append((line_number, validate_row(row, categories)))
+        except ValueError as e:
+            reject(line_number, str(e))
+            continue
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    if report['inserted']:
+        notify_question_change('bulk', [])
+    return report
+
+
+def export_questions(fmt='ndjson', chunk_size=BULK_CHUNK_SIZE):
+    columns = [getattr(Question, field) for field in FIELDS]
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(
+            select(*columns).order_by(Question.id))
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(FIELDS)
+            for rows in result.partitions(chunk_size):
+                writer.writerows(rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        else:
+            for rows in result.partitions(chunk_size):
+                yield ''.join(json.dumps(dict(zip(FIELDS, row))) + '\n'
+                              for row in rows)
@@ -0,0 +1,56 @@
+import threading
+
+from sqlalchemy import text
+
+from models import db
+
+'''
+CategoryCache
+
+The category map ({id: type}) and the question count of each category,
+cached in the process and tagged with category_version.version and
+counts_version (see migrations/003_category_cache.sql). Each use reads only
+that one-row table; the categories are read again when either has moved,
+which the database triggers do whenever a category is added, renamed or
+deleted, or a question write changes a count.
+'''
+
+CATEGORY_VERSIONS = text(
+    'SELECT version, counts_version FROM category_version WHERE id = 1')
+CATEGORIES = text(
+    'SELECT id, type, question_count FROM categories ORDER BY id')
+
+
+class CategoryCache:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = None
+        self._categories = {}
+        self._counts = {}
+
+    def current(self):
+        # (etag, {id: type}, {id: question count}); the dicts are shared and
+        # must not be modified.
+        row = db.session.execute(CATEGORY_VERSIONS).first()
+        versions = tuple(row) if row is not None else None
+        with self._lock:
+            if versions is not None and versions == self._versions:
+                return self._etag(), self._categories, self._counts
+        rows = db.session.execute(CATEGORIES).fetchall()
+        categories = {row.id: row.type for row in rows}
+        counts = {row.id: row.question_count for row in rows}
+        with self._lock:
+            self._versions = versions
+            self._categories = categories
+            self._counts = counts
+            return self._etag(), categories, counts
+
+    def categories(self):
+        return self.current()[1]
+
+    def _etag(self):
+        return 'categories-{}-{}'.format(*(self._versions or (0, 0)))
+
+
+category_cache = CategoryCache()
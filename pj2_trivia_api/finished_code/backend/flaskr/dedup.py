@@ -0,0 +1,209 @@
+import hashlib
+import json
+import re
+import zlib
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, insert, select, tuple_
+
+from models import Question, QuestionBucket, db, on_question_change
+
+'''
+Near-duplicate questions
+
+Question texts are normalized and cut into character shingles; a MinHash
+signature of NUM_PERM values (all permutations computed at once with
+NumPy) estimates the Jaccard similarity of two shingle sets. Signatures
+are split into BANDS bands of ROWS values and each band is hashed into a
+bucket stored in question_lsh, so the candidates for a new question are
+the questions sharing at least one of its BANDS buckets: an index lookup
+instead of a comparison with every question. Candidates are then checked
+against DEDUP_THRESHOLD with their own signatures.
+
+With 16 bands of 4 rows, pairs above ~0.5 similarity almost always share a
+bucket and pairs below ~0.3 rarely do.
+'''
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_random = np.random.RandomState(1)
+_A = _random.randint(1, 1 << 32, size=NUM_PERM).astype(np.uint64)
+_B = _random.randint(0, 1 << 32, size=NUM_PERM).astype(np.uint64)
+
+
+def shingles(text):
+    words = re.sub(r'[^a-z0-9]+', ' ', (text or '').lower()).split()
+    text = ' '.join(words)
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE]
+            for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def signature(text):
+    hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8'))
+                          for shingle in shingles(text)), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        permuted = (np.outer(_A, hashes) + _B[:, None]) \
+            % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def buckets(sig):
+    # (band, bucket) keys of a signature
+    return [(band, int.from_bytes(
+        hashlib.blake2b(rows.tobytes(), digest_size=8).digest(),
+        'little', signed=True))
+        for band, rows in enumerate(sig.reshape(BANDS, ROWS))]
+
+
+def similarity(sig_a, sig_b):
+    return float(np.mean(sig_a == sig_b))
+
+
+def bucket_rows(question_id, sig):
+    return [{'band': band, 'bucket': bucket, 'question_id': question_id}
+            for band, bucket in buckets(sig)]
+
+
+def find_duplicates(sigs, threshold=None):
+    # For each signature, the indexed questions at least `threshold`
+    # similar to it: [(question id, similarity), ...] best first.
+    if threshold is None:
+        threshold = current_app.config.get('DEDUP_THRESHOLD', 0.8)
+    keys = [buckets(sig) for sig in sigs]
+    wanted = {key for sig_keys in keys for key in sig_keys}
+    if not wanted:
+        return [[] for _ in sigs]
+    found = {}
+    for band, bucket, question_id in db.session.execute(
+            select(QuestionBucket.band, QuestionBucket.bucket,
+                   QuestionBucket.question_id)
+            .where(tuple_(QuestionBucket.band, QuestionBucket.bucket)
+                   .in_(list(wanted)))):
+        found.setdefault((band, bucket), set()).add(question_id)
+    candidate_ids = set().union(*found.values()) if found else set()
+    candidate_sigs = {question_id: signature(text)
+                      for question_id, text in db.session.execute(
+                          select(Question.id, Question.question)
+                          .where(Question.id.in_(candidate_ids)))} \
+        if candidate_ids else {}
+
+    results = []
+    for sig, sig_keys in zip(sigs, keys):
+        ids = set().union(*(found.get(key, ()) for key in sig_keys))
+        matches = [(question_id, similarity(sig, candidate_sigs[question_id]))
+                   for question_id in ids if question_id in candidate_sigs]
+        results.append(sorted(
+            (match for match in matches if match[1] >= threshold),
+            key=lambda match: (-match[1], match[0])))
+    return results
+
+
+def index_questions(questions):
+    # replaces the buckets of these questions, one statement for each step
+    db.session.execute(delete(QuestionBucket.__table__).where(
+        QuestionBucket.question_id.in_([question.id
+                                        for question in questions])))
+    db.session.execute(insert(QuestionBucket.__table__), [
+        row for question in questions
+        for row in bucket_rows(question.id, signature(question.question))])
+
+
+@on_question_change
+def _question_changed(event, questions):
+    # deleted questions lose their buckets through ON DELETE CASCADE;
+    # bulk imports index their own rows. Runs after the questions' own
+    # commit; a question missed here is indexed again by `flask dedup index`
+    if event not in ('insert', 'update') or not questions:
+        return
+    try:
+        index_questions(questions)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('could not index questions for dedup')
+
+
+class UnionFind:
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        self.parent.setdefault(item, item)
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a, b):
+        self.parent[self.find(a)] = self.find(b)
+
+
+def duplicate_clusters(threshold, chunk_size=1000):
+    # Groups of questions that are pairwise linked by similarity at or above
+    # threshold, from one streamed pass over the bank and in-memory LSH.
+    sigs, tables = {}, [{} for _ in range(BANDS)]
+    clusters = UnionFind()
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(
+            select(Question.id, Question.question).order_by(Question.id))
+        for rows in result.partitions(chunk_size):
+            for question_id, text in rows:
+                sig = sigs[question_id] = signature(text)
+                for band, bucket in buckets(sig):
+                    for other in tables[band].setdefault(bucket, []):
+                        if similarity(sig, sigs[other]) >= threshold:
+                            clusters.union(question_id, other)
+                    tables[band][bucket].append(question_id)
+    groups = {}
+    for question_id in list(clusters.parent):
+        groups.setdefault(clusters.find(question_id), []).append(question_id)
+    return sorted((sorted(group) for group in groups.values()
+                   if len(group) > 1), key=lambda group: group[0])
+
+
+dedup_cli = AppGroup('dedup', help='Near-duplicate question detection.')
+
+
+@dedup_cli.command('index')
+def index_command():
+    '''Rebuild the question_lsh buckets for every question.'''
+    db.session.execute(delete(QuestionBucket.__table__))
+    count = 0
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(
+            select(Question.id, Question.question).order_by(Question.id))
+        for rows in result.partitions(1000):
+            db.session.execute(insert(QuestionBucket.__table__), [
+                row for question_id, text in rows
+                for row in bucket_rows(question_id, signature(text))])
+            count += len(rows)
+    db.session.commit()
+    click.echo('Indexed {} questions.'.format(count))
+
+
+@dedup_cli.command('report')
+@click.option('--threshold', type=float, default=None,
+              help='Minimum estimated similarity (default DEDUP_THRESHOLD).')
+def report_command(threshold):
+    '''Print clusters of near-duplicate questions as JSON lines.'''
+    if threshold is None:
+        threshold = current_app.config.get('DEDUP_THRESHOLD', 0.8)
+    clusters = duplicate_clusters(threshold)
+    for group in clusters:
+        texts = {question_id: text for question_id, text in db.session.execute(
+            select(Question.id, Question.question)
+            .where(Question.id.in_(group)))}
+        click.echo(json.dumps({'ids': group,
+                               'questions': [texts[i] for i in group]}))
+    click.echo('{} clusters.'.format(len(clusters)), err=True)
@@ -0,0 +1,98 @@
+import json
+import threading
+from collections import OrderedDict
+
+from flask import Response
+
+from models import on_question_change
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+'''
+Question JSON fragments
+
+Each question's format() encoded once to JSON bytes and kept in an LRU of
+QUESTION_FRAGMENT_CACHE_SIZE entries, keyed by id and checked against the
+row's version (Question.version goes up on every update), so a question
+changed by another worker is never served stale. Changes in this process
+drop the entry at once.
+
+Responses with questions are assembled by splicing the cached fragments
+into the envelope, which is the only part encoded per request, with orjson
+when it is installed.
+'''
+
+
+if orjson is not None:
+    def dumps(value):
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps(value):
+        return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+class FragmentCache:
+
+    def __init__(self, size=10000):
+        self.size = size
+        self._lock = threading.Lock()
+        self._fragments = OrderedDict()
+
+    def init_app(self, app):
+        self.size = app.config.get('QUESTION_FRAGMENT_CACHE_SIZE', 10000)
+
+    def get(self, question):
+        # the JSON bytes of question.format()
+        with self._lock:
+            entry = self._fragments.get(question.id)
+            if entry is not None and entry[0] == question.version:
+                self._fragments.move_to_end(question.id)
+                return entry[1]
+        fragment = dumps(question.format())
+        with self._lock:
+            self._fragments[question.id] = (question.version, fragment)
+            self._fragments.move_to_end(question.id)
+            while len(self._fragments) > self.size:
+                self._fragments.popitem(last=False)
+        return fragment
+
+    def cached(self, question_id, version):
+        # the fragment of this version of a question, or None when it is not
+        # cached
+        with self._lock:
+            entry = self._fragments.get(question_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._fragments.move_to_end(question_id)
+            return entry[1]
+
+    def discard(self, question_id):
+        with self._lock:
+            self._fragments.pop(question_id, None)
+
+    def _changed(self, event, questions):
+        with self._lock:
+            for question in questions:
+                self._fragments.pop(question.id, None)
+
+
+def array(fragments):
+    return b'[' + b','.join(fragments) + b']'
+
+
+def json_response(fields, status=200, **encoded):
+    # fields are encoded here; encoded values (fragments, array()s of them)
+    # are spliced in as they are
+    spliced = b','.join(b'"' + name.encode('ascii') + b'":' + value
+                        for name, value in encoded.items())
+    body = dumps(fields)
+    if spliced:
+        body = b'{' + spliced + (b',' + body[1:] if fields else b'}')
+    return Response(body, status=status, mimetype='application/json')
+
+
+fragments = FragmentCache()
+on_question_change(fragments._changed)
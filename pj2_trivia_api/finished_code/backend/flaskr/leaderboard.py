@@ -0,0 +1,141 @@
+import threading
+import time
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import Integer, String
+
+from models import db
+from .writebehind import WriteBehind
+
+'''
+Leaderboard
+
+Quiz results are counted per (player, category) and, for the overall
+board, per (player, 0) in a WriteBehind buffer. A flush upserts the whole
+batch into scores with one statement and recomputes the top
+LEADERBOARD_SIZE rows of the categories it touched into leaderboard, each
+from an index scan of that category's best scores (see
+migrations/007_leaderboard.sql).
+
+Reads are served from an in-process copy of leaderboard, reloaded after
+each flush of this process and otherwise every LEADERBOARD_REFRESH seconds
+to pick up the flushes of other workers.
+'''
+
+MAX_PLAYER_LENGTH = 40
+
+UPSERT_SCORES = text('''
+    INSERT INTO scores (player, category, answered, correct)
+    SELECT * FROM unnest(:players, :categories, :answered, :correct)
+    ON CONFLICT (player, category) DO UPDATE
+    SET answered = scores.answered + excluded.answered,
+        correct = scores.correct + excluded.correct,
+        updated_at = now()
+''').bindparams(
+    bindparam('players', type_=ARRAY(String)),
+    bindparam('categories', type_=ARRAY(Integer)),
+    bindparam('answered', type_=ARRAY(Integer)),
+    bindparam('correct', type_=ARRAY(Integer)),
+)
+# Upserted rank by rank, so flushes of several workers can refresh the
+# same category at once; scores only grow, so a category never has fewer
+# top rows than before.
+REFRESH_TOP = text('''
+    INSERT INTO leaderboard (category, rank, player, correct, answered)
+    SELECT c.category, top.rank, top.player, top.correct, top.answered
+    FROM unnest(:categories) AS c (category)
+    CROSS JOIN LATERAL (
+        SELECT player, correct, answered,
+               row_number() OVER (ORDER BY correct DESC, answered, player)
+                 AS rank
+        FROM scores
+        WHERE scores.category = c.category
+        ORDER BY correct DESC, answered, player
+        LIMIT :size
+    ) AS top
+    ORDER BY c.category, top.rank
+    ON CONFLICT (category, rank) DO UPDATE
+    SET player = excluded.player, correct = excluded.correct,
+        answered = excluded.answered
+''').bindparams(bindparam('categories', type_=ARRAY(Integer)))
+TRIM_TOP = text('''
+    DELETE FROM leaderboard WHERE category = ANY(:categories) AND rank > :size
+''').bindparams(bindparam('categories', type_=ARRAY(Integer)))
+LEADERBOARD = text('''
+    SELECT category, rank, player, correct, answered FROM leaderboard
+    ORDER BY category, rank
+''')
+
+
+class Leaderboard:
+
+    def __init__(self):
+        self.size = 10
+        self.refresh_interval = 30
+        self.buffer = WriteBehind(self._write, after=self.reload)
+        self._lock = threading.Lock()
+        self._boards = {}
+        self._next_refresh = 0
+
+    def init_app(self, app):
+        self.size = app.config.get('LEADERBOARD_SIZE', 10)
+        self.refresh_interval = app.config.get('LEADERBOARD_REFRESH', 30)
+        self.buffer.init_app(app, app.config.get('SCORES_FLUSH_INTERVAL'),
+                             app.config.get('SCORES_MAX_PENDING'))
+        with self._lock:
+            self._next_refresh = 0
+
+    def record(self, player, category, answered, correct):
+        self.buffer.add((player, category), answered, correct)
+        if category:
+            self.buffer.add((player, 0), answered, correct)
+
+    def top(self, category=0):
+        with self._lock:
+            due = time.monotonic() >= self._next_refresh
+        if due:
+            self.reload()
+        with self._lock:
+            return self._boards.get(category, [])
+
+    def reload(self):
+        boards = {}
+        with db.engine.connect() as connection:
+            rows = connection.execute(LEADERBOARD).fetchall()
+        for row in rows:
+            boards.setdefault(row.category, []).append({
+                'rank': row.rank,
+                'player': row.player,
+                'correct': row.correct,
+                'answered': row.answered,
+            })
+        with self._lock:
+            self._boards = boards
+            self._next_refresh = time.monotonic() + self.refresh_interval
+
+    def _write(self, connection, batch):
+        keys = sorted(batch)
+        connection.execute(UPSERT_SCORES, {
+            'players': [player for player, _ in keys],
+            'categories': [category for _, category in keys],
+            'answered': [batch[key][0] for key in keys],
+            'correct': [batch[key][1] for key in keys],
+        })
+        categories = sorted({category for _, category in keys})
+        connection.execute(REFRESH_TOP, {'categories': categories,
+                                         'size': self.size})
+        # in case LEADERBOARD_SIZE was lowered
+        connection.execute(TRIM_TOP, {'categories': categories,
+                                      'size': self.size})
+
+
+def player_name(value):
+    # the trimmed player name, or None when it is not a usable one
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    return value if 0 < len(value) <= MAX_PLAYER_LENGTH else None
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,222 @@
+import gzip
+import hashlib
+import json
+import random
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import Integer
+
+from models import Question, db, on_question_change
+from .categories import category_cache
+from .pools import pools
+
+'''
+Quiz packs
+
+A pack is a whole quiz in one download: `size` shuffled questions of a
+category (0 for all categories) as gzip-compressed JSON, stored ready to
+send in quiz_packs (see migrations/006_quiz_packs.sql) with the SHA-1 of
+the compressed body as its ETag. Each category has QUIZ_PACKS_PER_SIZE
+packs of every size in QUIZ_PACK_SIZES, numbered from 0.
+
+Packs are sampled from the in-memory question pools, so building one reads
+only its own questions. They are kept current incrementally: a new
+question replaces a random question of each of its categories' packs with
+the probability it would have had of being sampled, a deleted or edited
+question is replaced or re-rendered only in the packs that contain it, and
+a bulk import rebuilds everything. Missing packs are built on first
+request; `flask packs build` rebuilds them all.
+'''
+
+GET_PACK = text('''
+    SELECT etag, body FROM quiz_packs
+    WHERE category = :category AND size = :size AND number = :number
+''')
+CATEGORY_PACKS = text('''
+    SELECT size, number, question_ids FROM quiz_packs
+    WHERE category = :category
+''')
+PACKS_WITH_QUESTIONS = text('''
+    SELECT category, size, number, question_ids FROM quiz_packs
+    WHERE question_ids && :question_ids
+''').bindparams(bindparam('question_ids', type_=ARRAY(Integer)))
+SAVE_PACK = text('''
+    INSERT INTO quiz_packs (category, size, number, question_ids, etag, body)
+    VALUES (:category, :size, :number, :question_ids, :etag, :body)
+    ON CONFLICT (category, size, number) DO UPDATE
+    SET question_ids = excluded.question_ids, etag = excluded.etag,
+        body = excluded.body, built_at = now()
+''').bindparams(bindparam('question_ids', type_=ARRAY(Integer)))
+DELETE_PACK = text('''
+    DELETE FROM quiz_packs
+    WHERE category = :category AND size = :size AND number = :number
+''')
+CLEAR_PACKS = text('DELETE FROM quiz_packs WHERE category = :category')
+
+
+def sizes():
+    return tuple(current_app.config.get('QUIZ_PACK_SIZES', (10, 20)))
+
+
+def packs_per_size():
+    return current_app.config.get('QUIZ_PACKS_PER_SIZE', 8)
+
+
+def load(question_ids):
+    return {question.id: question.format() for question in
+            Question.query.filter(Question.id.in_(question_ids))}
+
+
+def render(category, size, number, question_ids, questions=None):
+    # (etag, gzip body) of a pack with these questions, in this order;
+    # `questions` are their format()s when already loaded
+    if questions is None:
+        questions = load(question_ids)
+    body = gzip.compress(json.dumps({
+        'category': category,
+        'size': size,
+        'number': number,
+        'questions': [questions[question_id] for question_id in question_ids
+                      if question_id in questions],
+    }).encode('utf-8'), mtime=0)
+    return hashlib.sha1(body).hexdigest(), body
+
+
+def save(category, size, number, question_ids):
+    etag, body = render(category, size, number, question_ids)
+    db.session.execute(SAVE_PACK, {
+        'category': category, 'size': size, 'number': number,
+        'question_ids': list(question_ids), 'etag': etag, 'body': body,
+    })
+    return etag, body
+
+
+def build_category(category):
+    db.session.execute(CLEAR_PACKS, {'category': category})
+    for size in sizes():
+        for number in range(packs_per_size()):
+            question_ids = pools.sample(category, size)
+            if question_ids:
+                save(category, size, number, question_ids)
+    db.session.commit()
+
+
+def build_all():
+    for category in [0] + sorted(category_cache.categories()):
+        build_category(category)
+
+
+def get_pack(category, size, number):
+    # (etag, gzip body), building the category's packs when they are
+    # missing, or None when there is no such pack
+    if size not in sizes() or not 0 <= number < packs_per_size():
+        return None
+    if category and category not in category_cache.categories():
+        return None
+    row = db.session.execute(GET_PACK, {
+        'category': category, 'size': size, 'number': number}).first()
+    if row is None:
+        build_category(category)
+        row = db.session.execute(GET_PACK, {
+            'category': category, 'size': size, 'number': number}).first()
+    return (row.etag, bytes(row.body)) if row is not None else None
+
+
+def _added(question):
+    for category in (question.category, 0) if question.category else (0,):
+        count = pools.count(category)
+        for row in db.session.execute(
+                CATEGORY_PACKS, {'category': category}).fetchall():
+            question_ids = list(row.question_ids)
+            if question.id in question_ids:
+                continue
+            if len(question_ids) < row.size:
+                question_ids.append(question.id)
+                random.shuffle(question_ids)
+            elif random.random() < row.size / max(count, 1):
+                question_ids[random.randrange(row.size)] = question.id
+            else:
+                continue
+            save(category, row.size, row.number, question_ids)
+
+
+def _removed(changed):
+    # `changed` maps edited questions to their category now (0 for none) and
+    # deleted ones to None. Re-renders every pack with any of them, keeping
+    # a question only where it still belongs to the pack's category, with
+    # one query for the packs, one for their questions and one batch of
+    # writes.
+    rows = db.session.execute(PACKS_WITH_QUESTIONS,
+                              {'question_ids': sorted(changed)}).fetchall()
+    if not rows:
+        return
+    packs = []
+    for row in rows:
+        question_ids = list(row.question_ids)
+        for position, question_id in enumerate(question_ids):
+            if question_id not in changed:
+                continue
+            category = changed[question_id]
+            if category is None or row.category not in (0, category):
+                replacement = pools.sample(row.category, 1,
+                                           set(question_ids) | set(changed))
+                question_ids[position] = replacement[0] if replacement \
+                    else None
+        packs.append((row, [question_id for question_id in question_ids
+                            if question_id is not None]))
+
+    questions = load({question_id for _, question_ids in packs
+                      for question_id in question_ids})
+    saved, deleted = [], []
+    for row, question_ids in packs:
+        key = {'category': row.category, 'size': row.size,
+               'number': row.number}
+        if question_ids:
+            etag, body = render(row.category, row.size, row.number,
+                                question_ids, questions)
+            saved.append(dict(key, question_ids=question_ids, etag=etag,
+                              body=body))
+        else:
+            deleted.append(key)
+    if saved:
+        db.session.execute(SAVE_PACK, saved)
+    if deleted:
+        db.session.execute(DELETE_PACK, deleted)
+
+
+@on_question_change
+def _question_changed(event, questions):
+    # runs after the questions' own commit, which must not be reported as
+    # failed because a pack could not be kept current; a pack missed here
+    # is still valid, just not up to date
+    try:
+        if event == 'bulk':
+            build_all()
+            return
+        if event == 'insert':
+            for question in questions:
+                _added(question)
+        elif event == 'update':
+            _removed({question.id: question.category or 0
+                      for question in questions})
+        else:
+            _removed({question.id: None for question in questions})
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('could not update quiz packs')
+
+
+packs_cli = AppGroup('packs', help='Downloadable quiz packs.')
+
+
+@packs_cli.command('build')
+def build_command():
+    '''Rebuild every quiz pack.'''
+    build_all()
+    click.echo('Built quiz packs for {} categories.'.format(
+        len(category_cache.categories()) + 1))
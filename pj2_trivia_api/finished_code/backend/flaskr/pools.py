@@ -0,0 +1,230 @@
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from random import randrange, sample
+
+from models import Question, db, on_question_change
+from .fragments import fragments
+
+'''
+QuestionPools
+
+Question ids held in memory, as sorted arrays per category (0 for all
+categories) and per (category, difficulty), so a quiz draw is a random pick
+from an array instead of a query. The pools are built on first use from
+one scan of (id, category, difficulty), kept current by Question.insert(),
+update() and delete() in this process, and rebuilt every
+QUESTION_POOL_RESYNC seconds by a background thread of each process to pick
+up changes made by other workers. Changes made in this process while a
+rebuild scans the table are applied again to its result.
+
+A drawn question is served from the fragment cache (see fragments.py) when
+the cached fragment is of the row's current version, which is one primary
+key read, and is otherwise read in full.
+'''
+
+# random picks tried before scanning a pool for an id not yet excluded
+PROBES = 8
+
+
+class QuestionPools:
+
+    def __init__(self):
+        self.resync_interval = 60
+        self._app = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.RLock()
+        self._built = False
+        self._pools = {}
+        # (id, (category, difficulty) or None when deleted) of the
+        # changes made while a build scans the table
+        self._replay = None
+        self._wake = threading.Event()
+        self._pid = None
+
+    def init_app(self, app):
+        self.resync_interval = app.config.get('QUESTION_POOL_RESYNC', 60)
+        self._app = app
+        app.extensions['question_pools'] = self
+
+    def build(self):
+        with self._build_lock:
+            with self._lock:
+                self._replay = []
+            pools = {}
+            try:
+                for question_id, category, difficulty in db.session.query(
+                        Question.id, Question.category,
+                        Question.difficulty).order_by(Question.id):
+                    for key in _keys(category, difficulty):
+                        pools.setdefault(key, array('l')).append(question_id)
+            except Exception:
+                with self._lock:
+                    self._replay = None
+                raise
+            with self._lock:
+                self._pools = pools
+                for question_id, values in self._replay:
+                    self._remove(question_id)
+                    if values is not None:
+                        self._add(question_id, *values)
+                self._replay = None
+                self._built = True
+
+    def add(self, question_id, category, difficulty):
+        with self._lock:
+            self._add(question_id, category, difficulty)
+
+    def remove(self, question_id):
+        with self._lock:
+            self._remove(question_id)
+
+    def count(self, category=0, difficulty=None):
+        self._ensure_built()
+        key = (_category(category), difficulty) if difficulty else \
+            _category(category)
+        with self._lock:
+            return len(self._pools.get(key, ()))
+
+    def sample(self, category=0, k=10, exclude=()):
+        # Up to k distinct random ids of the category, none in `exclude`.
+        self._ensure_built()
+        with self._lock:
+            ids = self._pools.get(_category(category), ())
+            picked = sample(ids, min(k + len(exclude), len(ids)))
+        return [question_id for question_id in picked
+                if question_id not in exclude][:k]
+
+    def draw(self, category=0, exclude=(), difficulty=None):
+        # (id, JSON fragment) of a random question of the category (and
+        # difficulty) whose id is not in `exclude`, or None when all of them
+        # are. Raises LookupError when the category has no questions at all.
+        self._ensure_built()
+        key = (_category(category), difficulty) if difficulty else \
+            _category(category)
+        retry = False
+        while True:
+            with self._lock:
+                ids = self._pools.get(key)
+                if not ids:
+                    if retry:
+                        # the rest of the pool was deleted meanwhile
+                        return None
+                    raise LookupError(category)
+                count = len(ids)
+                question_id = next(
+                    (ids[index] for index in
+                     (randrange(count) for _ in range(PROBES))
+                     if ids[index] not in exclude), None)
+                if question_id is None:
+                    # most of the pool is excluded: scan it from a random
+                    # start
+                    start = randrange(count)
+                    question_id = next(
+                        (ids[(start + offset) % count]
+                         for offset in range(count)
+                         if ids[(start + offset) % count] not in exclude),
+                        None)
+            if question_id is None:
+                return None
+            fragment = self.get(question_id)
+            if fragment is not None:
+                return question_id, fragment
+            # deleted by another worker since the last resync
+            self.remove(question_id)
+            retry = True
+
+    def draw_near(self, category=0, exclude=(), difficulty=3):
+        # Like draw(), from the closest difficulty to `difficulty` that has
+        # questions left, easier first on ties.
+        for offset in (0, -1, 1, -2, 2, -3, 3, -4, 4):
+            if not 1 <= difficulty + offset <= 5:
+                continue
+            try:
+                question = self.draw(category, exclude, difficulty + offset)
+            except LookupError:
+                continue
+            if question is not None:
+                return question
+        # questions without a difficulty from 1 to 5, if any
+        return self.draw(category, exclude)
+
+    def get(self, question_id):
+        # the question's JSON fragment, or None when it does not exist
+        version = db.session.query(Question.version).filter(
+            Question.id == question_id).scalar()
+        if version is None:
+            return None
+        fragment = fragments.cached(question_id, version)
+        if fragment is not None:
+            return fragment
+        question = Question.query.get(question_id)
+        return fragments.get(question) if question is not None else None
+
+    def _ensure_built(self):
+        # The first build is waited for; later ones run on the resync
+        # thread and serve the old pools meanwhile.
+        with self._lock:
+            built = self._built
+            if self._pid != os.getpid():
+                # first use in this process; threads do not survive a fork
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, daemon=True).start()
+        if not built:
+            with self._build_lock:
+                if not self._built:
+                    self.build()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.resync_interval)
+            self._wake.clear()
+            try:
+                with self._app.app_context():
+                    self.build()
+            except Exception:
+                self._app.logger.exception('question pool resync failed')
+
+    def _add(self, question_id, category, difficulty):
+        for key in _keys(category, difficulty):
+            ids = self._pools.setdefault(key, array('l'))
+            position = bisect_left(ids, question_id)
+            if position == len(ids) or ids[position] != question_id:
+                ids.insert(position, question_id)
+
+    def _remove(self, question_id):
+        for ids in self._pools.values():
+            position = bisect_left(ids, question_id)
+            if position < len(ids) and ids[position] == question_id:
+                del ids[position]
+
+    def _changed(self, event, questions):
+        if event == 'bulk':
+            self._wake.set()
+            return
+        with self._lock:
+            for question in questions:
+                values = None if event == 'delete' else (
+                    question.category, question.difficulty)
+                self._remove(question.id)
+                if values is not None:
+                    self._add(question.id, *values)
+                if self._replay is not None:
+                    self._replay.append((question.id, values))
+
+
+def _category(category):
+    return int(category) if category else 0
+
+
+def _keys(category, difficulty):
+    category = _category(category)
+    keys = [0, category] if category else [0]
+    if difficulty is not None:
+        keys += [(key, difficulty) for key in keys]
+    return keys
+
+
+pools = QuestionPools()
+on_question_change(pools._changed)
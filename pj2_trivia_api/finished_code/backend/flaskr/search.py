@@ -0,0 +1,75 @@
+from sqlalchemy import text
+
+from models import db
+
+'''
+Question search
+
+Matches the term against questions and answers with full-text search
+(questions.search_vector, see migrations/001_question_search.sql) or as a
+substring (ILIKE, served by the pg_trgm indexes), ranks the matches and
+returns one page of them. Highlighted snippets are only computed for the
+rows of that page.
+'''
+
+SEARCH_QUESTIONS = text('''
+    WITH query AS (
+        SELECT websearch_to_tsquery('english', :term) AS tsquery
+    ), page AS (
+        SELECT q.id, q.question, q.answer, q.category, q.difficulty,
+               ts_rank_cd(q.search_vector, query.tsquery)
+                 + similarity(q.question, :term) AS rank,
+               count(*) OVER () AS total
+        FROM questions q, query
+        WHERE q.search_vector @@ query.tsquery
+           OR q.question ILIKE :pattern
+           OR q.answer ILIKE :pattern
+        ORDER BY rank DESC, q.id
+        LIMIT :limit OFFSET :offset
+    )
+    SELECT page.*,
+           ts_headline('english', page.question, query.tsquery,
+                       'StartSel=<mark>, StopSel=</mark>, HighlightAll=true')
+             AS question_headline,
+           ts_headline('english', page.answer, query.tsquery,
+                       'StartSel=<mark>, StopSel=</mark>, HighlightAll=true')
+             AS answer_headline
+    FROM page, query
+    ORDER BY page.rank DESC, page.id
+''')
+# the total for a page past the last one, which has no rows to carry it
+COUNT_MATCHES = text('''
+    SELECT count(*)
+    FROM questions q
+    WHERE q.search_vector @@ websearch_to_tsquery('english', :term)
+       OR q.question ILIKE :pattern
+       OR q.answer ILIKE :pattern
+''')
+
+
+def like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%') \
+        .replace('_', '\\_')
+    return '%' + escaped + '%'
+
+
+def search_questions(term, page, per_page):
+    # (questions on the page, total matches)
+    params = {'term': term, 'pattern': like_pattern(term)}
+    rows = db.session.execute(SEARCH_QUESTIONS, dict(
+        params, limit=per_page, offset=max(page - 1, 0) * per_page)).fetchall()
+    questions = [{
+        'id': row.id,
+        'question': row.question,
+        'answer': row.answer,
+        'category': row.category,
+        'difficulty': row.difficulty,
+        'rank': round(float(row.rank), 4),
+        'question_headline': row.question_headline,
+        'answer_headline': row.answer_headline,
+    } for row in rows]
+    if rows:
+        return questions, rows[0].total
+    if page > 1:
+        return questions, db.session.execute(COUNT_MATCHES, params).scalar()
+    return questions, 0
@@ -0,0 +1,121 @@
+import struct
+from array import array
+from bisect import bisect_left
+
+'''
+SeenSet
+
+A compact set of question ids, laid out like a roaring bitmap: ids are
+grouped by their upper 16 bits and each group keeps its lower 16 bits
+either as a sorted array of shorts (up to ARRAY_LIMIT ids, 2 bytes each)
+or, once it is denser than that, as a fixed 8 KiB bitmap. A quiz session
+of a few dozen questions serializes to about a hundred bytes, and lookups
+cost a dict probe plus a binary search or a bit test.
+'''
+
+ARRAY_LIMIT = 4096
+BITMAP_BYTES = 1 << 13
+
+_HEADER = struct.Struct('<I')
+_CONTAINER = struct.Struct('<HBI')
+
+
+class SeenSet:
+
+    def __init__(self, ids=()):
+        self._containers = {}
+        self._count = 0
+        for question_id in ids:
+            self.add(question_id)
+
+    def add(self, question_id):
+        high, low = divmod(int(question_id), 1 << 16)
+        container = self._containers.get(high)
+        if container is None:
+            container = self._containers[high] = array('H')
+        if isinstance(container, bytearray):
+            byte, bit = divmod(low, 8)
+            if container[byte] >> bit & 1:
+                return False
+            container[byte] |= 1 << bit
+        else:
+            position = bisect_left(container, low)
+            if position < len(container) and container[position] == low:
+                return False
+            container.insert(position, low)
+            if len(container) > ARRAY_LIMIT:
+                self._containers[high] = _to_bitmap(container)
+        self._count += 1
+        return True
+
+    def __contains__(self, question_id):
+        high, low = divmod(int(question_id), 1 << 16)
+        container = self._containers.get(high)
+        if container is None:
+            return False
+        if isinstance(container, bytearray):
+            return bool(container[low >> 3] >> (low & 7) & 1)
+        position = bisect_left(container, low)
+        return position < len(container) and container[position] == low
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for high in sorted(self._containers):
+            container = self._containers[high]
+            if isinstance(container, bytearray):
+                lows = (byte * 8 + bit
+                        for byte, value in enumerate(container) if value
+                        for bit in range(8) if value >> bit & 1)
+            else:
+                lows = container
+            for low in lows:
+                yield high << 16 | low
+
+    def to_bytes(self):
+        parts = [_HEADER.pack(len(self._containers))]
+        for high in sorted(self._containers):
+            container = self._containers[high]
+            if isinstance(container, bytearray):
+                count = sum(bin(value).count('1') for value in container)
+                parts += [_CONTAINER.pack(high, 1, count), bytes(container)]
+            else:
+                parts += [_CONTAINER.pack(high, 0, len(container)),
+                          _little_endian(container).tobytes()]
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        seen = cls()
+        (containers,) = _HEADER.unpack_from(data, 0)
+        offset = _HEADER.size
+        for _ in range(containers):
+            high, kind, count = _CONTAINER.unpack_from(data, offset)
+            offset += _CONTAINER.size
+            if kind == 1:
+                container = bytearray(data[offset:offset + BITMAP_BYTES])
+                offset += BITMAP_BYTES
+            else:
+                container = array('H')
+                container.frombytes(data[offset:offset + 2 * count])
+                container = _little_endian(container)
+                offset += 2 * count
+            seen._containers[high] = container
+            seen._count += count
+        return seen
+
+
+def _to_bitmap(container):
+    bitmap = bytearray(BITMAP_BYTES)
+    for low in container:
+        bitmap[low >> 3] |= 1 << (low & 7)
+    return bitmap
+
+
+def _little_endian(values):
+    # Serialized arrays are little-endian whatever the host is.
+    if struct.pack('=H', 1) != struct.pack('<H', 1):
+        values = array('H', values)
+        values.byteswap()
+    return values
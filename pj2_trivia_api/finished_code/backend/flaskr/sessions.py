@@ -0,0 +1,169 @@
+import secrets
+import threading
+import time
+
+from sqlalchemy import (Boolean, Column, Float, Integer, LargeBinary,
+                        MetaData, String, Table, create_engine, delete,
+                        insert, select, update)
+
+from .seen import SeenSet
+
+'''
+Quiz sessions
+
+A session remembers a quiz's category and the questions it has already
+asked (a SeenSet), so clients send only the session id with each request.
+Sessions expire QUIZ_SESSION_TTL seconds after they were last used.
+
+Adaptive sessions also count the answers reported for their questions and
+ask the next question at the difficulty that matches the running accuracy.
+
+QUIZ_SESSION_STORE picks where they live:
+    'memory'  this process only (a single worker, or development)
+    'sql'     a table in QUIZ_SESSION_DATABASE_URI (any SQLAlchemy URL,
+              e.g. sqlite:////tmp/quiz.db), or the trivia database when
+              that is None; shared by every worker
+'''
+
+SWEEP_INTERVAL = 60
+
+
+class QuizSession:
+
+    def __init__(self, id, category, seen=None, adaptive=False, answered=0,
+                 correct=0, current=None):
+        self.id = id
+        self.category = category
+        self.seen = seen if seen is not None else SeenSet()
+        self.adaptive = adaptive
+        self.answered = answered
+        self.correct = correct
+        # the asked question that has not been answered yet
+        self.current = current
+
+    def accuracy(self):
+        return self.correct / self.answered if self.answered else None
+
+    def difficulty(self):
+        # 1 to 5 from the accuracy so far, smoothed so that a new session
+        # starts in the middle and one answer moves it by at most one step
+        smoothed = (self.correct + 1) / (self.answered + 2)
+        return min(5, max(1, 1 + round(smoothed * 4)))
+
+    def answer(self, correct):
+        self.answered += 1
+        self.correct += 1 if correct else 0
+        self.current = None
+
+
+class MemoryStore:
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    def create(self, category, adaptive=False):
+        session = QuizSession(secrets.token_urlsafe(16), category,
+                              adaptive=adaptive)
+        self.save(session)
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            return entry[0]
+
+    def save(self, session):
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[session.id] = (session, now + self.ttl)
+            if now >= self._next_sweep:
+                self._next_sweep = now + SWEEP_INTERVAL
+                for session_id, (_, expires) in list(self._sessions.items()):
+                    if expires <= now:
+                        del self._sessions[session_id]
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+
+class SQLStore:
+
+    def __init__(self, engine, ttl):
+        self.engine = engine
+        self.ttl = ttl
+        self._next_sweep = time.time() + SWEEP_INTERVAL
+        metadata = MetaData()
+        self.table = Table(
+            'quiz_sessions', metadata,
+            Column('id', String(32), primary_key=True),
+            Column('category', Integer, nullable=False),
+            Column('seen', LargeBinary, nullable=False),
+            Column('adaptive', Boolean, nullable=False, default=False),
+            Column('answered', Integer, nullable=False, default=0),
+            Column('correct', Integer, nullable=False, default=0),
+            Column('current', Integer),
+            Column('expires_at', Float, nullable=False, index=True),
+        )
+        metadata.create_all(engine)
+
+    def create(self, category, adaptive=False):
+        session = QuizSession(secrets.token_urlsafe(16), category,
+                              adaptive=adaptive)
+        with self.engine.begin() as connection:
+            connection.execute(insert(self.table).values(
+                id=session.id, category=category, adaptive=adaptive,
+                seen=session.seen.to_bytes(),
+                expires_at=time.time() + self.ttl))
+        return session
+
+    def get(self, session_id):
+        columns = self.table.c
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                select(columns.category, columns.seen, columns.adaptive,
+                       columns.answered, columns.correct, columns.current)
+                .where(columns.id == session_id,
+                       columns.expires_at > time.time())).first()
+        if row is None:
+            return None
+        return QuizSession(session_id, row.category,
+                           SeenSet.from_bytes(bytes(row.seen)), row.adaptive,
+                           row.answered, row.correct, row.current)
+
+    def save(self, session):
+        now = time.time()
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(self.table).where(self.table.c.id == session.id).values(
+                    seen=session.seen.to_bytes(), answered=session.answered,
+                    correct=session.correct, current=session.current,
+                    expires_at=now + self.ttl))
+            if now >= self._next_sweep:
+                self._next_sweep = now + SWEEP_INTERVAL
+                connection.execute(
+                    delete(self.table).where(self.table.c.expires_at <= now))
+
+    def delete(self, session_id):
+        with self.engine.begin() as connection:
+            return connection.execute(delete(self.table).where(
+                self.table.c.id == session_id)).rowcount > 0
+
+
+def init_session_store(app, db):
+    ttl = app.config.get('QUIZ_SESSION_TTL', 3600)
+    kind = app.config.get('QUIZ_SESSION_STORE', 'memory')
+    if kind == 'memory':
+        store = MemoryStore(ttl)
+    elif kind == 'sql':
+        uri = app.config.get('QUIZ_SESSION_DATABASE_URI')
+        store = SQLStore(create_engine(uri) if uri else db.engine, ttl)
+    else:
+        raise ValueError('Unknown QUIZ_SESSION_STORE: %r' % kind)
+    app.extensions['quiz_sessions'] = store
+    return store
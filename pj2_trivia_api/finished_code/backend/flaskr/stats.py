@@ -0,0 +1,46 @@
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import Integer
+
+from .writebehind import WriteBehind
+
+'''
+Answer statistics
+
+How often each question was answered in quiz sessions and how often
+correctly, in question_stats (see migrations/005_question_stats.sql).
+Answers are counted in a WriteBehind buffer and upserted for a whole batch
+of questions with one statement, so a busy quiz does not write once per
+answer. Questions deleted in the meantime are skipped.
+'''
+
+UPSERT_STATS = text('''
+    INSERT INTO question_stats (question_id, answered, correct)
+    SELECT s.question_id, s.answered, s.correct
+    FROM unnest(:question_ids, :answered, :correct)
+           AS s (question_id, answered, correct)
+    JOIN questions q ON q.id = s.question_id
+    ON CONFLICT (question_id) DO UPDATE
+    SET answered = question_stats.answered + excluded.answered,
+        correct = question_stats.correct + excluded.correct
+''').bindparams(
+    bindparam('question_ids', type_=ARRAY(Integer)),
+    bindparam('answered', type_=ARRAY(Integer)),
+    bindparam('correct', type_=ARRAY(Integer)),
+)
+
+
+def write_answer_stats(connection, batch):
+    question_ids = sorted(batch)
+    connection.execute(UPSERT_STATS, {
+        'question_ids': question_ids,
+        'answered': [batch[question_id][0] for question_id in question_ids],
+        'correct': [batch[question_id][1] for question_id in question_ids],
+    })
+
+
+answer_stats = WriteBehind(write_answer_stats)
+
+
+def record_answer(question_id, correct):
+    answer_stats.add(question_id, 1, 1 if correct else 0)
@@ -0,0 +1,119 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+from flask import has_app_context
+
+from models import db
+
+'''
+WriteBehind
+
+Counters that are summed in memory and written to the database in
+batches: add() only updates a dict, and the pending sums are handed to
+`write(connection, batch)` in one transaction once `interval` seconds have
+passed since the last write or `max_pending` keys are waiting, and when the
+process exits; `after()`, if given, runs once a write has committed.
+Writes run on a daemon thread of each process, started by its first add(),
+so requests never wait for them and an idle worker still writes its counts
+on time. Counts buffered by a worker that dies are lost, which is the price
+of not writing on every request.
+
+A failed write puts its counts back to be retried with the next batch; a
+failing `after()` is logged and does not undo the write. Neither stops the
+flusher thread.
+'''
+
+
+class WriteBehind:
+
+    def __init__(self, write, interval=5, max_pending=500, after=None):
+        self.write = write
+        self.after = after
+        self.interval = interval
+        self.max_pending = max_pending
+        self._app = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._next_flush = time.monotonic() + interval
+        self._flushing = False
+        self._wake = threading.Event()
+        self._pid = None
+
+    def init_app(self, app, interval=None, max_pending=None):
+        if interval is not None:
+            self.interval = interval
+        if max_pending is not None:
+            self.max_pending = max_pending
+        if self._app is None:
+            atexit.register(self.flush)
+        self._app = app
+
+    def add(self, key, *deltas):
+        with self._lock:
+            counts = self._pending.get(key)
+            if counts is None:
+                self._pending[key] = list(deltas)
+            else:
+                for i, delta in enumerate(deltas):
+                    counts[i] += delta
+            full = len(self._pending) >= self.max_pending
+            if self._pid != os.getpid():
+                # first use in this process; threads do not survive a fork
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, daemon=True).start()
+        if full:
+            self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        with self._lock:
+            if self._flushing or not self._pending or self._app is None:
+                return
+            self._flushing = True
+            batch, self._pending = self._pending, {}
+            self._next_flush = time.monotonic() + self.interval
+        try:
+            with self._context():
+                with db.engine.begin() as connection:
+                    self.write(connection, batch)
+        except Exception:
+            self._app.logger.exception('write-behind flush failed')
+            with self._lock:
+                for key, deltas in batch.items():
+                    counts = self._pending.setdefault(key, [0] * len(deltas))
+                    for i, delta in enumerate(deltas):
+                        counts[i] += delta
+            return
+        finally:
+            self._flushing = False
+        if self.after is not None:
+            try:
+                with self._context():
+                    self.after()
+            except Exception:
+                self._app.logger.exception('write-behind after() failed')
+
+    def _run(self):
+        while True:
+            try:
+                with self._lock:
+                    delay = max(self._next_flush - time.monotonic(), 0) \
+                        if self._pending else self.interval
+                self._wake.wait(delay)
+                self._wake.clear()
+                self.flush()
+            except Exception:
+                # the thread must outlive any failure: no other one is
+                # started in this process
+                self._app.logger.exception('write-behind flusher failed')
+
+    def _context(self):
+        # Pushing a second app context inside a request would end the
+        # request's database session when it is popped.
+        return nullcontext() if has_app_context() else self._app.app_context()
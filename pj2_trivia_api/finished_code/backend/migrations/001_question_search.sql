@@ -0,0 +1,40 @@
+-- Full-text and substring search over questions and answers.
+--
+--   psql trivia < migrations/001_question_search.sql
+--
+-- search_vector holds the question (weight A) and the answer (weight B) and
+-- is kept current by a trigger; pg_trgm indexes serve substring matches.
+-- Safe to run more than once.
+
+BEGIN;
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE public.questions ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION public.questions_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.question, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.answer, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS questions_search_vector_update ON public.questions;
+CREATE TRIGGER questions_search_vector_update
+    BEFORE INSERT OR UPDATE OF question, answer ON public.questions
+    FOR EACH ROW EXECUTE PROCEDURE public.questions_search_vector_update();
+
+UPDATE public.questions SET search_vector =
+    setweight(to_tsvector('english', coalesce(question, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(answer, '')), 'B');
+
+CREATE INDEX IF NOT EXISTS questions_search_vector_idx
+    ON public.questions USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS questions_question_trgm_idx
+    ON public.questions USING gin (question gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS questions_answer_trgm_idx
+    ON public.questions USING gin (answer gin_trgm_ops);
+
+COMMIT;
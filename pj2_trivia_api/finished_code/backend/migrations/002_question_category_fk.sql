@@ -0,0 +1,46 @@
+-- questions.category as an indexed integer foreign key to categories.id.
+--
+--   psql trivia < migrations/002_question_category_fk.sql
+--
+-- Databases created by db.create_all() have a varchar category; restores of
+-- trivia.psql already have an integer with the foreign key. Either way,
+-- categories that are not a category id are cleared first. Safe to run
+-- more than once.
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = 'questions'
+          AND column_name = 'category') <> 'integer' THEN
+        ALTER TABLE public.questions ALTER COLUMN category TYPE integer
+            USING CASE WHEN trim(category) ~ '^[0-9]+$'
+                       THEN trim(category)::integer END;
+    END IF;
+END
+$$;
+
+UPDATE public.questions SET category = NULL
+WHERE category IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM public.categories c WHERE c.id = category);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'public.questions'::regclass
+                     AND contype = 'f') THEN
+        ALTER TABLE public.questions
+            ADD CONSTRAINT category FOREIGN KEY (category)
+            REFERENCES public.categories(id) ON UPDATE CASCADE ON DELETE SET NULL;
+    END IF;
+END
+$$;
+
+-- Also serves lookups by category alone (its leading column).
+CREATE INDEX IF NOT EXISTS questions_category_difficulty_idx
+    ON public.questions USING btree (category, difficulty);
+
+ANALYZE public.questions;
+
+COMMIT;
@@ -0,0 +1,116 @@
+-- Per-category question counts and versions for cached category maps.
+--
+--   psql trivia < migrations/003_category_cache.sql
+--
+-- categories.question_count is kept current by statement-level triggers on
+-- questions (one UPDATE per statement and category, so bulk inserts stay
+-- cheap). category_version.version is bumped by statements that add,
+-- rename or delete categories; category_version.counts_version by the
+-- question statements that change a count (edits that keep the category do
+-- not). Servers compare both with the versions of their cached categories
+-- and counts. Safe to run more than once; running it again replaces the
+-- triggers.
+
+BEGIN;
+
+ALTER TABLE public.categories
+    ADD COLUMN IF NOT EXISTS question_count integer NOT NULL DEFAULT 0;
+
+UPDATE public.categories c SET question_count =
+    (SELECT count(*) FROM public.questions q WHERE q.category = c.id);
+
+CREATE TABLE IF NOT EXISTS public.category_version (
+    id integer PRIMARY KEY CHECK (id = 1),
+    version bigint NOT NULL
+);
+ALTER TABLE public.category_version
+    ADD COLUMN IF NOT EXISTS counts_version bigint NOT NULL DEFAULT 1;
+INSERT INTO public.category_version (id, version) VALUES (1, 1)
+    ON CONFLICT (id) DO UPDATE SET version = public.category_version.version + 1;
+
+CREATE OR REPLACE FUNCTION public.category_version_bump() RETURNS trigger AS $$
+BEGIN
+    UPDATE public.category_version SET version = version + 1 WHERE id = 1;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS category_version_bump ON public.categories;
+CREATE TRIGGER category_version_bump
+    AFTER INSERT OR DELETE OR UPDATE OF type ON public.categories
+    FOR EACH STATEMENT EXECUTE PROCEDURE public.category_version_bump();
+
+CREATE OR REPLACE FUNCTION public.question_counts_bump() RETURNS void AS $$
+    UPDATE public.category_version SET counts_version = counts_version + 1
+    WHERE id = 1;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION public.question_count_insert() RETURNS trigger AS $$
+BEGIN
+    UPDATE public.categories c SET question_count = c.question_count + n.added
+    FROM (SELECT category, count(*) AS added FROM new_rows
+          WHERE category IS NOT NULL GROUP BY category) n
+    WHERE c.id = n.category;
+    IF FOUND THEN
+        PERFORM public.question_counts_bump();
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.question_count_delete() RETURNS trigger AS $$
+BEGIN
+    UPDATE public.categories c SET question_count = c.question_count - o.removed
+    FROM (SELECT category, count(*) AS removed FROM old_rows
+          WHERE category IS NOT NULL GROUP BY category) o
+    WHERE c.id = o.category;
+    IF FOUND THEN
+        PERFORM public.question_counts_bump();
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.question_count_update() RETURNS trigger AS $$
+BEGIN
+    -- most updates edit text; leave categories alone
+    IF NOT EXISTS (SELECT 1 FROM new_rows n JOIN old_rows o ON o.id = n.id
+                   WHERE n.category IS DISTINCT FROM o.category) THEN
+        RETURN NULL;
+    END IF;
+    UPDATE public.categories c SET question_count = c.question_count + d.delta
+    FROM (SELECT category, sum(delta) AS delta FROM (
+              SELECT n.category, 1 AS delta
+              FROM new_rows n JOIN old_rows o ON o.id = n.id
+              WHERE n.category IS DISTINCT FROM o.category
+              UNION ALL
+              SELECT o.category, -1
+              FROM new_rows n JOIN old_rows o ON o.id = n.id
+              WHERE n.category IS DISTINCT FROM o.category
+          ) changes
+          WHERE category IS NOT NULL GROUP BY category HAVING sum(delta) <> 0) d
+    WHERE c.id = d.category;
+    IF FOUND THEN
+        PERFORM public.question_counts_bump();
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS question_count_insert ON public.questions;
+CREATE TRIGGER question_count_insert
+    AFTER INSERT ON public.questions REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE public.question_count_insert();
+
+DROP TRIGGER IF EXISTS question_count_delete ON public.questions;
+CREATE TRIGGER question_count_delete
+    AFTER DELETE ON public.questions REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE public.question_count_delete();
+
+DROP TRIGGER IF EXISTS question_count_update ON public.questions;
+CREATE TRIGGER question_count_update
+    AFTER UPDATE ON public.questions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE public.question_count_update();
+
+COMMIT;
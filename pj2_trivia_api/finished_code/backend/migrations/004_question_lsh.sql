@@ -0,0 +1,23 @@
+-- LSH buckets for near-duplicate question detection (flaskr/dedup.py).
+--
+--   psql trivia < migrations/004_question_lsh.sql
+--   flask dedup index
+--
+-- One row per (band, bucket) of each question's MinHash signature; rows go
+-- away with their question. Run `flask dedup index` afterwards to fill the
+-- table for existing questions. Safe to run more than once.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.question_lsh (
+    band smallint NOT NULL,
+    bucket bigint NOT NULL,
+    question_id integer NOT NULL
+        REFERENCES public.questions (id) ON DELETE CASCADE,
+    PRIMARY KEY (band, bucket, question_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_question_lsh_question_id
+    ON public.question_lsh (question_id);
+
+COMMIT;
@@ -0,0 +1,30 @@
+-- Per-question answer counts from quiz sessions (flaskr/stats.py).
+--
+--   psql trivia < migrations/005_question_stats.sql
+--
+-- Rows are upserted in batches by the servers and go away with their
+-- question. Safe to run more than once.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.question_stats (
+    question_id integer PRIMARY KEY
+        REFERENCES public.questions (id) ON DELETE CASCADE,
+    answered integer NOT NULL DEFAULT 0,
+    correct integer NOT NULL DEFAULT 0
+);
+
+-- quiz sessions stored with QUIZ_SESSION_STORE = 'sql' in the trivia
+-- database predate adaptive sessions; they are short-lived, so start over
+DO $$
+BEGIN
+    IF to_regclass('public.quiz_sessions') IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = 'quiz_sessions'
+              AND column_name = 'adaptive') THEN
+        DROP TABLE public.quiz_sessions;
+    END IF;
+END
+$$;
+
+COMMIT;
@@ -0,0 +1,28 @@
+-- Precomputed quiz packs (flaskr/packs.py).
+--
+--   psql trivia < migrations/006_quiz_packs.sql
+--   FLASK_APP=flaskr flask packs build
+--
+-- One row per pack: the gzip-compressed JSON body served as is, its ETag
+-- and the ids of its questions, indexed to find the packs a changed
+-- question is in. category 0 holds the packs drawn from all categories.
+-- Packs are built on first request, or all at once with
+-- `flask packs build`. Safe to run more than once.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.quiz_packs (
+    category integer NOT NULL,
+    size smallint NOT NULL,
+    number smallint NOT NULL,
+    question_ids integer[] NOT NULL,
+    etag text NOT NULL,
+    body bytea NOT NULL,
+    built_at timestamp with time zone NOT NULL DEFAULT now(),
+    PRIMARY KEY (category, size, number)
+);
+
+CREATE INDEX IF NOT EXISTS quiz_packs_question_ids_idx
+    ON public.quiz_packs USING gin (question_ids);
+
+COMMIT;
@@ -0,0 +1,34 @@
+-- Player scores and the leaderboard (flaskr/leaderboard.py).
+--
+--   psql trivia < migrations/007_leaderboard.sql
+--
+-- scores holds the answers counted per player and category (0 for all
+-- categories), upserted in batches by the servers; the index serves the
+-- top-N scan of a category. leaderboard holds the top rows of each
+-- category, recomputed for the categories a batch touched. Safe to run
+-- more than once.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.scores (
+    player varchar(40) NOT NULL,
+    category integer NOT NULL,
+    answered bigint NOT NULL DEFAULT 0,
+    correct bigint NOT NULL DEFAULT 0,
+    updated_at timestamp with time zone NOT NULL DEFAULT now(),
+    PRIMARY KEY (player, category)
+);
+
+CREATE INDEX IF NOT EXISTS scores_category_rank_idx
+    ON public.scores (category, correct DESC, answered, player);
+
+CREATE TABLE IF NOT EXISTS public.leaderboard (
+    category integer NOT NULL,
+    rank integer NOT NULL,
+    player varchar(40) NOT NULL,
+    correct bigint NOT NULL,
+    answered bigint NOT NULL,
+    PRIMARY KEY (category, rank)
+);
+
+COMMIT;
@@ -0,0 +1,29 @@
+-- A row version on questions for the cached JSON fragments
+-- (flaskr/fragments.py).
+--
+--   psql trivia < migrations/008_question_version.sql
+--
+-- The application bumps questions.version with every update it makes; the
+-- trigger bumps it for updates that do not, such as the SET NULL cascade
+-- when a category is deleted. Safe to run more than once.
+
+BEGIN;
+
+ALTER TABLE public.questions
+    ADD COLUMN IF NOT EXISTS version integer NOT NULL DEFAULT 1;
+
+CREATE OR REPLACE FUNCTION public.questions_bump_version() RETURNS trigger AS $$
+BEGIN
+    IF NEW.version = OLD.version THEN
+        NEW.version := OLD.version + 1;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS questions_bump_version ON public.questions;
+CREATE TRIGGER questions_bump_version
+    BEFORE UPDATE ON public.questions
+    FOR EACH ROW EXECUTE PROCEDURE public.questions_bump_version();
+
+COMMIT;
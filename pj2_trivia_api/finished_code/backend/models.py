@@ -1,5 +1,6 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from sqlalchemy import (Column, String, Integer, SmallInteger, BigInteger,
+                        ForeignKey, Index, create_engine)
 from flask_sqlalchemy import SQLAlchemy
 from config import database_setup, SQLALCHEMY_TRACK_MODIFICATIONS
 import json
@@ -27,6 +28,26 @@ def setup_db(app, database_path=database_path):
     db.create_all()
 
 
+'''
+question_listeners
+    called as listener(event, questions) after Question.insert(), update()
+    and delete() commit, with event 'insert', 'update' or 'delete' and a
+    list of the changed questions (one, or all rows of a batch change), and
+    as listener('bulk', []) after an import of any number of questions
+'''
+question_listeners = []
+
+
+def on_question_change(listener):
+    question_listeners.append(listener)
+    return listener
+
+
+def notify_question_change(event, questions):
+    for listener in question_listeners:
+        listener(event, questions)
+
+
 '''
 Question
 
@@ -35,12 +56,20 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        Index('questions_category_difficulty_idx', 'category', 'difficulty'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey(
+        'categories.id', onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
+    # bumped on every update, see flaskr/fragments.py
+    version = Column(Integer, nullable=False, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
@@ -51,13 +80,16 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        notify_question_change('insert', [self])
 
     def update(self):
         db.session.commit()
+        notify_question_change('update', [self])
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        notify_question_change('delete', [self])
 
     def format(self):
         return {
@@ -69,6 +101,38 @@ class Question(db.Model):
         }
 
 
+'''
+QuestionBucket
+    LSH buckets of question texts, see flaskr/dedup.py
+
+'''
+
+
+class QuestionBucket(db.Model):
+    __tablename__ = 'question_lsh'
+
+    band = Column(SmallInteger, primary_key=True)
+    bucket = Column(BigInteger, primary_key=True)
+    question_id = Column(Integer, ForeignKey(
+        'questions.id', ondelete='CASCADE'), primary_key=True, index=True)
+
+
+'''
+QuestionStats
+    answers given to a question in quiz sessions, see flaskr/stats.py
+
+'''
+
+
+class QuestionStats(db.Model):
+    __tablename__ = 'question_stats'
+
+    question_id = Column(Integer, ForeignKey(
+        'questions.id', ondelete='CASCADE'), primary_key=True)
+    answered = Column(Integer, nullable=False, server_default='0')
+    correct = Column(Integer, nullable=False, server_default='0')
+
+
 '''
 Category
 
@@ -80,6 +144,8 @@ class Category(db.Model):
 
     id = Column(Integer, primary_key=True)
     type = Column(String)
+    # maintained by triggers, see migrations/003_category_cache.sql
+    question_count = Column(Integer, nullable=False, server_default='0')
 
     def __init__(self, type):
         self.type = type
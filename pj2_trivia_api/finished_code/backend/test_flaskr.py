@@ -1,16 +1,41 @@
+import gzip
 import os
 import unittest
 import json
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.dedup import buckets, signature, similarity
+from flaskr.fragments import FragmentCache, array, json_response
+from flaskr.leaderboard import leaderboard
+from flaskr.seen import SeenSet
+from flaskr.sessions import QuizSession
+from models import setup_db, Question, Category, db
 from config import database_setup
 
+MIGRATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'migrations')
+
+
+def apply_migrations(engine):
+    # the schema create_all() does not know about (search vectors,
+    # triggers, ...); every migration is safe to run more than once
+    connection = engine.raw_connection()
+    try:
+        for name in sorted(os.listdir(MIGRATIONS)):
+            if name.endswith('.sql'):
+                with open(os.path.join(MIGRATIONS, name)) as f:
+                    connection.cursor().execute(f.read())
+        connection.commit()
+    finally:
+        connection.close()
+
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    migrated = False
+
     def setUp(self):
         """Define test variables and initialize app."""
         db_user = database_setup["user_name"]
@@ -31,6 +56,13 @@ class TriviaTestCase(unittest.TestCase):
             self.db.init_app(self.app)
             # create all tables
             self.db.create_all()
+            if not TriviaTestCase.migrated:
+                apply_migrations(db.engine)
+                TriviaTestCase.migrated = True
+            # questions above this id are created by the test and removed
+            # in tearDown
+            self.last_question_id = db.session.query(
+                db.func.max(Question.id)).scalar() or 0
 
         # Sample question(s) for testing:
         self.new_question = {
@@ -48,7 +80,16 @@ class TriviaTestCase(unittest.TestCase):
 
     def tearDown(self):
         """Executed after reach test"""
-        pass
+        with self.app.app_context():
+            Question.query.filter(Question.id > self.last_question_id) \
+                .delete(synchronize_session=False)
+            db.session.commit()
+
+    def category_question_ids(self, category):
+        with self.app.app_context():
+            return [question.id for question in
+                    Question.query.filter_by(category=category)
+                    .order_by(Question.id)]
 
     """
     TODO
@@ -62,6 +103,33 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['categories'])
 
+    def test_get_categories_not_modified(self):
+        res = self.client().get('/categories')
+        cached = self.client().get(
+            '/categories', headers={'If-None-Match': res.headers['ETag']})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(cached.status_code, 304)
+
+    def test_get_categories_counts_new_question(self):
+        before = json.loads(self.client().get('/categories').data)
+        self.client().post('/questions',
+                           json=dict(self.new_question, allow_duplicate=True))
+        res = self.client().get('/categories')
+        after = json.loads(res.data)
+
+        self.assertEqual(after['question_counts']['6'],
+                         before['question_counts']['6'] + 1)
+
+    def test_get_categories_etag_follows_counts(self):
+        etag = self.client().get('/categories').headers['ETag']
+        self.client().post('/questions',
+                           json=dict(self.new_question, allow_duplicate=True))
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
     def test_fail_to_get_categories(self):
         res = self.client().get('/categories/7')
         data = json.loads(res.data)
@@ -75,6 +143,33 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['total_questions'] > 0)
 
+    def test_get_questions_page(self):
+        first = json.loads(self.client().get('/questions?page=1').data)
+        second = json.loads(self.client().get('/questions?page=2').data)
+
+        self.assertEqual(len(first['questions']), 10)
+        self.assertEqual(first['total_questions'], second['total_questions'])
+        self.assertTrue(first['questions'][-1]['id'] <
+                        second['questions'][0]['id'])
+
+    def test_get_questions_after_cursor(self):
+        first = json.loads(self.client().get('/questions').data)
+        res = self.client().get(
+            '/questions?after={}'.format(first['next_after']))
+        data = json.loads(res.data)
+        second = json.loads(self.client().get('/questions?page=2').data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['questions'], second['questions'])
+        self.assertEqual(data['total_questions'], first['total_questions'])
+
+    def test_fail_to_get_questions_past_last_page(self):
+        res = self.client().get('/questions?page=1993')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
     def test_fail_to_get_questions(self):
         res = self.client().get('/questions/1993')
         data = json.loads(res.data)
@@ -101,11 +196,137 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
 
     def test_create_question(self):
-        res = self.client().post('/questions', json=self.new_question)
+        res = self.client().post('/questions',
+                                 json=dict(self.new_question, allow_duplicate=True))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+
+    def test_409_near_duplicate_question(self):
+        created = json.loads(self.client().post(
+            '/questions', json=dict(self.new_question, allow_duplicate=True)).data)
+        res = self.client().post('/questions', json=dict(
+            self.new_question,
+            question='When did an NHL team from a Canadian city win the Stanley Cup?'))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 409)
+        self.assertFalse(data['success'])
+        self.assertIn(created['created'],
+                      [duplicate['id'] for duplicate in data['duplicates']])
+
+    def test_bulk_import_questions(self):
+        body = '\n'.join([
+            json.dumps({'question': 'Which planet is known as the Red Planet?',
+                        'answer': 'Mars', 'category': 1, 'difficulty': 1}),
+            json.dumps({'question': 'Missing answer', 'category': 1,
+                        'difficulty': 1}),
+        ])
+        res = self.client().post('/questions/bulk?allow_duplicates=true',
+                                 data=body, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['failed'], 1)
+        self.assertEqual(data['errors'][0]['line'], 2)
+
+    def test_bulk_import_questions_csv(self):
+        body = 'question,answer,category,difficulty\n' \
+               '"Who painted the Sistine Chapel ceiling?",Michelangelo,2,2\n'
+        res = self.client().post('/questions/bulk?allow_duplicates=true',
+                                 data=body, content_type='text/csv')
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['success'])
+        self.assertEqual(data['inserted'], 1)
+
+    def test_bulk_import_rejects_near_duplicates(self):
+        body = '\n'.join([
+            json.dumps({'question': 'Which river flows through Baghdad?',
+                        'answer': 'Tigris', 'category': 3, 'difficulty': 2}),
+            json.dumps({'question': 'Which river flows through Baghdad ?',
+                        'answer': 'The Tigris', 'category': 3, 'difficulty': 2}),
+        ])
+        res = self.client().post('/questions/bulk', data=body,
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(data['success'])
+        self.assertEqual(data['errors'][-1]['line'], 2)
+        self.assertTrue(data['errors'][-1]['error'].startswith('duplicate of'))
+
+    def test_batch_delete_questions(self):
+        created = json.loads(self.client().post(
+            '/questions', json=dict(self.new_question, allow_duplicate=True)).data)
+        res = self.client().delete('/questions',
+                                   json={'ids': [created['created']]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['deleted'], 1)
+
+    def test_batch_delete_questions_partially(self):
+        created = json.loads(self.client().post(
+            '/questions', json=dict(self.new_question, allow_duplicate=True)).data)
+        res = self.client().delete('/questions',
+                                   json={'ids': [created['created'], 1993]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(data['success'])
+        self.assertEqual(data['deleted'], 1)
+        self.assertEqual([r['status'] for r in data['results']],
+                         ['deleted', 'not_found'])
+
+    def test_422_batch_delete_without_ids(self):
+        res = self.client().delete('/questions', json={'ids': 'all'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+
+    def test_batch_update_questions(self):
+        created = json.loads(self.client().post(
+            '/questions', json=dict(self.new_question, allow_duplicate=True)).data)
+        res = self.client().patch('/questions', json={'questions': [
+            {'id': created['created'], 'difficulty': 3, 'version': 1},
+            {'id': 1993, 'answer': 'Nobody'},
+            {'id': created['created'], 'difficulty': 9},
+        ]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(data['success'])
+        self.assertEqual(data['updated'], 1)
+        self.assertEqual([r['status'] for r in data['results']],
+                         ['updated', 'not_found', 'invalid'])
+        self.assertEqual(data['results'][0]['version'], 2)
+
+    def test_batch_update_reports_version_conflict(self):
+        created = json.loads(self.client().post(
+            '/questions', json=dict(self.new_question, allow_duplicate=True)).data)
+        res = self.client().patch('/questions', json={'questions': [
+            {'id': created['created'], 'difficulty': 3, 'version': 7},
+        ]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['results'][0]['status'], 'conflict')
+
+    def test_export_questions(self):
+        res = self.client().get('/questions/export')
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+        listed = json.loads(self.client().get('/questions').data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(rows), listed['total_questions'])
+        self.assertEqual(set(rows[0]),
+                         {'id', 'question', 'answer', 'category', 'difficulty'})
 
     def test_search_question(self):
         res = self.client().post('/questions/search',
@@ -114,6 +335,34 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(res.status_code, 200)
 
+    def test_search_question_matches_answers(self):
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'Uruguay'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['questions'][0]['id'], 11)
+        self.assertIn('<mark>Uruguay</mark>',
+                      data['questions'][0]['answer_headline'])
+
+    def test_search_question_substring(self):
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'Scissor'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(any(question['id'] == 6
+                            for question in data['questions']))
+
+    def test_search_page_past_the_end_keeps_total(self):
+        res = self.client().post('/questions/search?page=100',
+                                 json={'searchTerm': 'Uruguay'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['questions'], [])
+        self.assertGreater(data['total_questions'], 0)
+
     def test_failed_search_question(self):
         res = self.client().post('/questions/search',
                                  json={'search_term': ' '})
@@ -129,6 +378,158 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['question'])
 
+    def test_get_quiz_skips_previous_questions(self):
+        ids = self.category_question_ids(6)
+        res = self.client().post('/quizzes', json={'previous_questions': ids[:-1],
+                                                   'quiz_category': {'id': '6', 'type': 'Sports'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], ids[-1])
+
+    def test_get_quiz_when_all_questions_seen(self):
+        ids = self.category_question_ids(6)
+        res = self.client().post('/quizzes', json={'previous_questions': ids,
+                                                   'quiz_category': {'id': '6', 'type': 'Sports'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(data['success'])
+
+    def test_get_quiz_includes_new_question(self):
+        created = json.loads(self.client().post(
+            '/questions', json=dict(self.new_question, allow_duplicate=True)).data)
+        ids = [question_id for question_id in self.category_question_ids(6)
+               if question_id != created['created']]
+        res = self.client().post('/quizzes', json={'previous_questions': ids,
+                                                   'quiz_category': {'id': '6', 'type': 'Sports'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], created['created'])
+
+    def test_get_quiz_by_difficulty(self):
+        res = self.client().post('/quizzes', json={'previous_questions': [],
+                                                   'quiz_category': {'id': 0},
+                                                   'difficulty': 2})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['difficulty'], 2)
+
+    def test_quiz_session_never_repeats(self):
+        res = self.client().post('/quizzes/sessions',
+                                 json={'quiz_category': {'id': '6', 'type': 'Sports'}})
+        session_id = json.loads(res.data)['session_id']
+        ids = self.category_question_ids(6)
+
+        asked = []
+        for _ in ids:
+            data = json.loads(self.client().post(
+                '/quizzes/sessions/{}/next'.format(session_id)).data)
+            asked.append(data['question']['id'])
+        data = json.loads(self.client().post(
+            '/quizzes/sessions/{}/next'.format(session_id)).data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(asked), ids)
+        self.assertFalse(data['success'])
+
+    def test_fail_to_get_quiz_session_question(self):
+        res = self.client().post('/quizzes/sessions/1993/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
+    def test_adaptive_quiz_session(self):
+        res = self.client().post('/quizzes/sessions', json={'adaptive': True})
+        session_id = json.loads(res.data)['session_id']
+
+        for _ in range(3):
+            self.client().post('/quizzes/sessions/{}/next'.format(session_id))
+            res = self.client().post('/quizzes/sessions/{}/answer'.format(session_id),
+                                     json={'correct': True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['answered'], 3)
+        self.assertEqual(data['accuracy'], 1.0)
+        self.assertEqual(data['next_difficulty'], 4)
+
+    def test_422_answer_without_question(self):
+        res = self.client().post('/quizzes/sessions', json={})
+        session_id = json.loads(res.data)['session_id']
+        res = self.client().post('/quizzes/sessions/{}/answer'.format(session_id),
+                                 json={'correct': True})
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_delete_quiz_session(self):
+        res = self.client().post('/quizzes/sessions', json={})
+        session_id = json.loads(res.data)['session_id']
+        res = self.client().delete('/quizzes/sessions/{}'.format(session_id))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.client().post(
+            '/quizzes/sessions/{}/next'.format(session_id)).status_code, 404)
+
+    def test_record_quiz_result(self):
+        res = self.client().post('/quizzes/results', json={
+            'player': 'Ada', 'quiz_category': {'id': 1}, 'answered': 5, 'correct': 4})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+
+    def test_422_quiz_result(self):
+        res = self.client().post('/quizzes/results', json={
+            'player': 'Ada', 'answered': 5, 'correct': 6})
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_get_leaderboard(self):
+        self.client().post('/quizzes/results', json={
+            'player': 'Grace', 'quiz_category': {'id': 2}, 'answered': 1000, 'correct': 1000})
+        leaderboard.buffer.flush()
+        res = self.client().get('/leaderboard?category=2')
+        overall = json.loads(self.client().get('/leaderboard').data)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Grace', [leader['player'] for leader in data['leaders']])
+        self.assertIn('Grace', [leader['player'] for leader in overall['leaders']])
+
+    def test_404_leaderboard_category(self):
+        res = self.client().get('/leaderboard?category=1993')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_list_quiz_packs(self):
+        res = self.client().get('/quizzes/packs')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['packs'])
+
+    def test_get_quiz_pack(self):
+        res = self.client().get('/quizzes/packs/0/10/0',
+                                headers={'Accept-Encoding': 'gzip'})
+        pack = json.loads(gzip.decompress(res.data))
+        cached = self.client().get('/quizzes/packs/0/10/0', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': res.headers['ETag']})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(pack['questions']), 10)
+        self.assertEqual(len({q['id'] for q in pack['questions']}), 10)
+        self.assertEqual(cached.status_code, 304)
+
+    def test_404_quiz_pack_size(self):
+        res = self.client().get('/quizzes/packs/0/11/0')
+
+        self.assertEqual(res.status_code, 404)
+
     def test_fail_to_get_quiz(self):
         res = self.client().post('/quizzes', json={'previous_questions': [],
                                                    'quiz_category': {'id': '1993', 'type': 'Viet Nam'}})
@@ -158,6 +559,100 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 422)
 
 
+class SeenSetTestCase(unittest.TestCase):
+    """This class tests the quiz sessions' seen-question set"""
+
+    def test_sparse_and_dense_ids(self):
+        ids = [1, 5, 70000] + list(range(200000, 205000))
+        seen = SeenSet(ids)
+
+        self.assertEqual(len(seen), len(ids))
+        self.assertIn(70000, seen)
+        self.assertIn(204999, seen)
+        self.assertNotIn(2, seen)
+        self.assertNotIn(205000, seen)
+        self.assertFalse(seen.add(5))
+
+    def test_round_trip(self):
+        seen = SeenSet([3, 9, 65536] + list(range(131072, 136000)))
+        copy = SeenSet.from_bytes(seen.to_bytes())
+
+        self.assertEqual(list(copy), list(seen))
+        self.assertEqual(len(copy), len(seen))
+
+
+class QuizSessionTestCase(unittest.TestCase):
+    """This class tests the adaptive difficulty of quiz sessions"""
+
+    def test_difficulty_follows_accuracy(self):
+        session = QuizSession('s', 0)
+        self.assertEqual(session.difficulty(), 3)
+
+        for _ in range(8):
+            session.answer(True)
+        self.assertEqual(session.difficulty(), 5)
+
+        for _ in range(24):
+            session.answer(False)
+        self.assertEqual(session.difficulty(), 2)
+
+
+class FragmentsTestCase(unittest.TestCase):
+    """This class tests the pre-encoded question JSON"""
+
+    def setUp(self):
+        self.question = Question('Who wrote Hamlet?', 'Shakespeare', 4, 2)
+        self.question.id = 42
+        self.question.version = 1
+
+    def test_fragment_follows_version(self):
+        cache = FragmentCache()
+        first = cache.get(self.question)
+        self.question.answer = 'William Shakespeare'
+
+        self.assertIs(cache.get(self.question), first)
+        self.question.version = 2
+        self.assertEqual(json.loads(cache.get(self.question))['answer'],
+                         'William Shakespeare')
+
+    def test_cached_fragment_needs_current_version(self):
+        cache = FragmentCache()
+        fragment = cache.get(self.question)
+
+        self.assertIs(cache.cached(42, 1), fragment)
+        self.assertIsNone(cache.cached(42, 2))
+        self.assertIsNone(cache.cached(43, 1))
+
+    def test_json_response_splices_fragments(self):
+        cache = FragmentCache()
+        res = json_response({'success': True, 'total_questions': 1},
+                            questions=array([cache.get(self.question)]))
+
+        self.assertEqual(json.loads(res.get_data()), {
+            'success': True,
+            'total_questions': 1,
+            'questions': [self.question.format()],
+        })
+
+
+class MinHashTestCase(unittest.TestCase):
+    """This class tests the near-duplicate question signatures"""
+
+    def test_near_duplicates_are_similar(self):
+        a = signature('Which country won the first ever soccer World Cup in 1930?')
+        b = signature('which country won the first-ever soccer world cup in 1930')
+        c = signature('What is the largest lake in Africa?')
+
+        self.assertGreaterEqual(similarity(a, b), 0.8)
+        self.assertLess(similarity(a, c), 0.3)
+
+    def test_near_duplicates_share_a_bucket(self):
+        a = signature('Who discovered penicillin in 1928?')
+        b = signature('Who discovered penicillin, in 1928?')
+
+        self.assertTrue(set(buckets(a)) & set(buckets(b)))
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()